@@ -0,0 +1,207 @@
+"""
+Runs the brench configs in one process per core instead of a shell pipeline
+per benchmark and run.
+
+    python3 bench.py ../brench/df_brench.toml --csv ../brench/results.csv
+
+Each benchmark is turned into json once. Every run of the config then applies
+its passes to a fresh copy in-process with the driver's passes, and executes
+the result with interp.py. The pipelines in the toml are mapped onto passes,
+e.g. "python3 ../python/lvn.py" is the lvn pass; see _script_passes.
+
+The csv has brench's columns (benchmark,run,result), so analyze.ipynb reads it
+as before: result is the dynamic instruction count, or incorrect / timeout /
+missing like brench. --json also keeps the seconds and peak memory of every
+pass.
+"""
+
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+import tomllib
+import tracemalloc
+
+from blocks import BasicBlocks
+from driver import PASSES
+from interp import BrilError, StepLimit, run
+from parallel import imap
+
+# pass scripts, and what running them does in terms of driver passes
+_script_passes = {
+    "lvn.py": ["lvn"],
+    "dataflow.py": ["dataflow_dce"],
+    "trivial_dce.py": ["tdce"],
+    "loops.py": ["licm"],
+    "sccp.py": ["to_ssa", "sccp", "from_ssa"],
+    "gvn.py": ["to_ssa", "gvn", "from_ssa"],
+    "test_blocks.py": [],
+}
+
+
+def pipeline_passes(pipeline: list[str]) -> list[str]:
+    """translates a brench pipeline into the driver passes it amounts to"""
+    passes = []
+    for step in pipeline:
+        words = shlex.split(step)
+        if words[0] in ("bril2json", "brili"):
+            continue
+        if words[0].startswith("python") and len(words) > 1:
+            script = os.path.basename(words[1])
+            if script == "driver.py":
+                spec = [w for w in words[2:] if not w.startswith("-")]
+                passes += [p for p in spec[0].split(",") if p] if spec else []
+                continue
+            if script in _script_passes:
+                passes += _script_passes[script]
+                continue
+        raise ValueError(f"don't know how to run {step!r} in-process")
+    return passes
+
+
+def load_config(path: str):
+    """returns the benchmark glob and {run name: passes} of a brench toml"""
+    with open(path, "rb") as f:
+        config = tomllib.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    runs = {
+        name: pipeline_passes(run_config["pipeline"])
+        for name, run_config in config["runs"].items()
+    }
+    return os.path.join(base, config["benchmarks"]), runs
+
+
+def load_benchmark(path: str, bril2json="bril2json"):
+    """returns the program's json text and the args of its # ARGS: line"""
+    with open(path) as f:
+        text = f.read()
+    args = []
+    m = re.search(r"ARGS:(.*)", text)
+    if m:
+        args = m.group(1).split()
+    if not path.endswith(".json"):
+        cmd = shlex.split(bril2json)
+        result = subprocess.run(cmd, input=text, capture_output=True, text=True)
+        if result.returncode:
+            raise ValueError(result.stderr.strip() or f"{bril2json} failed")
+        text = result.stdout
+    return text, args
+
+
+def run_benchmark(text, args, passes, limit=None, memory=True):
+    """
+    optimizes one program with passes and runs it. returns a status (ok,
+    timeout or error), the run's stdout, its dynamic instruction count and
+    the per pass stats.
+    """
+    prog = json.loads(text)
+    bbs = [BasicBlocks(func) for func in prog["functions"]]
+
+    stats = []
+    for p in passes:
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            bbs = [PASSES[p](bb) for bb in bbs]
+        except Exception as e:  # a broken pass is a missing result, as in brench
+            print(f"{p}: {e!r}", file=sys.stderr)
+            return "error", None, None, stats
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            stats.append({"pass": p, "seconds": seconds, "peak_bytes": peak})
+
+    prog["functions"] = [bb.to_func() for bb in bbs]
+    out = io.StringIO()
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        interp = run(prog, args, out, limit=limit)
+        dyn_inst = interp.dyn_inst
+    except StepLimit:
+        status, dyn_inst = "timeout", None
+    except BrilError:
+        status, dyn_inst = "error", None
+    stats.append({"pass": "interp", "seconds": time.perf_counter() - start})
+    return status, out.getvalue(), dyn_inst, stats
+
+
+def bench(path, runs, bril2json="bril2json", limit=None, memory=True):
+    """every run of runs on one benchmark, as a list of result rows"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        text, args = load_benchmark(path, bril2json)
+    except (OSError, ValueError) as e:
+        print(f"{name}: {e}", file=sys.stderr)
+        return [{"benchmark": name, "run": r, "result": "missing"} for r in runs]
+
+    rows = []
+    expected = None
+    for run_name, passes in runs.items():
+        status, out, dyn_inst, stats = run_benchmark(text, args, passes, limit, memory)
+        if expected is None and status == "ok":
+            expected = out  # brench checks every run against the first one
+        if status == "ok":
+            result = dyn_inst if out == expected else "incorrect"
+        elif status == "timeout":
+            result = "timeout"
+        else:
+            result = "missing"
+        rows.append(
+            {"benchmark": name, "run": run_name, "result": result, "passes": stats}
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="a brench toml")
+    parser.add_argument("--benchmarks", help="glob overriding the config's")
+    parser.add_argument("--csv", help="write brench style results here, not stdout")
+    parser.add_argument("--json", help="also write per pass timings and memory here")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=0, help="worker processes, 0 for one per cpu"
+    )
+    parser.add_argument(
+        "--limit", type=int, default=10**8, help="instructions before a timeout"
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="don't trace allocations, which slows the passes down",
+    )
+    parser.add_argument("--bril2json", default="bril2json")
+    args = parser.parse_args()
+
+    pattern, runs = load_config(args.config)
+    if args.benchmarks:
+        pattern = args.benchmarks
+    paths = sorted(glob.glob(pattern))
+
+    def work(path):
+        return bench(path, runs, args.bril2json, args.limit, not args.no_memory)
+
+    results = [row for rows in imap(paths, work, args.jobs) for row in rows]
+
+    out = open(args.csv, "w", newline="") if args.csv else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(["benchmark", "run", "result"])
+    for row in results:
+        writer.writerow([row["benchmark"], row["run"], row["result"]])
+    if args.csv:
+        out.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,7 +1,7 @@
 from copy import deepcopy
-from collections import deque
+from collections import defaultdict
 
-debug_mode = False
+import metrics
 
 
 def _get_used_labels(instrs: list[dict]):
@@ -12,37 +12,172 @@ def _get_used_labels(instrs: list[dict]):
     return used
 
 
-def _gen_reverse_postorder(adj, i):
+def _gen_reverse_postorder(adj, entry=0):
+    """
+    returns the nodes reachable from entry in reverse postorder. the dfs keeps
+    its own stack so deep cfgs don't hit the recursion limit.
+    """
+    if not adj:
+        return []
 
     visited = [False] * len(adj)
+    visited[entry] = True
+    postorder = []
+    stack = [(entry, iter(adj[entry]))]
+    while stack:
+        i, children = stack[-1]
+        for j in children:
+            if not visited[j]:
+                visited[j] = True
+                stack.append((j, iter(adj[j])))
+                break
+        else:
+            stack.pop()
+            postorder.append(i)
+
+    postorder.reverse()
+    return postorder
+
+
+_terminators = ("jmp", "br", "ret")
 
-    def dfs(i, path) -> list:
-        if visited[i]:
-            return path
+# analyses derived from the cfg. they are computed on first use and dropped by
+# any edit that could change them, see BasicBlocks.__getattr__.
+_dom_attrs = (
+    "rpo",
+    "idom",
+    "dom",
+    "dom_tree",
+    "dom_children",
+    "_dt_pre",
+    "_dt_post",
+    "_dom_frontier",
+    "loop_forest",
+)
 
-        visited[i] = True
 
-        for j in adj[i]:
-            dfs(j, path)
+SSA_MODES = ("minimal", "semi_pruned", "pruned")
 
-        path.append(i)
 
-        return path
+def _typed(types, v):
+    return {"type": types[v]} if v in types else {}
 
-    path = []
-    for i in range(len(adj)):
-        if not visited[i]:
-            path.extend(dfs(i, []))
 
-    return reversed(path)
+def _falls_through(block):
+    return bool(block) and block[-1].get("op") not in _terminators
+
+
+# cfgs with more blocks than this get their dominators from Lengauer-Tarjan
+_lt_min_blocks = 1000
+
+
+def _lengauer_tarjan(succ, pred):
+    """
+    the idom array of the cfg, by Lengauer and Tarjan's "A Fast Algorithm
+    for Finding Dominators in a Flowgraph", the simple version with path
+    compression. it works on dfs preorder numbers and keeps its own stacks.
+    """
+    n = len(succ)
+    idom = [None] * n
+    if not n:
+        return idom
+
+    # dfs preorder from the entry. num[v] is v's number, vertex the inverse
+    num = [None] * n
+    num[0] = 0
+    vertex = [0]
+    parent = [None]
+    stack = [(0, iter(succ[0]))]
+    while stack:
+        v, children = stack[-1]
+        for w in children:
+            if num[w] is None:
+                num[w] = len(vertex)
+                vertex.append(w)
+                parent.append(v)
+                stack.append((num[w], iter(succ[w])))
+                break
+        else:
+            stack.pop()
+
+    # from here on everything is in preorder numbers
+    m = len(vertex)
+    semi = list(range(m))
+    label = list(range(m))
+    ancestor = [None] * m
+    dom = [None] * m
+    bucket = [[] for _ in range(m)]
+
+    def evaluate(v):
+        if ancestor[v] is None:
+            return v
+        # compress the path to the root of v's tree, top down
+        path = []
+        while ancestor[ancestor[v]] is not None:
+            path.append(v)
+            v = ancestor[v]
+        for x in reversed(path):
+            a = ancestor[x]
+            if semi[label[a]] < semi[label[x]]:
+                label[x] = label[a]
+            ancestor[x] = ancestor[a]
+        return label[path[0]] if path else label[v]
+
+    for w in range(m - 1, 0, -1):
+        for p in pred[vertex[w]]:
+            if num[p] is None:
+                continue  # unreachable
+            u = evaluate(num[p])
+            if semi[u] < semi[w]:
+                semi[w] = semi[u]
+        bucket[semi[w]].append(w)
+        p = parent[w]
+        ancestor[w] = p
+        for v in bucket[p]:
+            u = evaluate(v)
+            dom[v] = u if semi[u] < semi[v] else p
+        bucket[p] = []
+
+    for w in range(1, m):
+        if dom[w] != semi[w]:
+            dom[w] = dom[dom[w]]
+        idom[vertex[w]] = vertex[dom[w]]
+    return idom
+
+
+class DomSets:
+    """
+    read only view of the dominator sets, derived from the idom array. dom[b]
+    is built on demand by walking up the idom chain from b, so the full
+    O(n^2) table never exists.
+    """
+
+    def __init__(self, idom):
+        self._idom = idom
+
+    def __len__(self):
+        return len(self._idom)
+
+    def __getitem__(self, b):
+        dom = {b}
+        b = self._idom[b]
+        while b is not None:
+            dom.add(b)
+            b = self._idom[b]
+        return dom
+
+    def __iter__(self):
+        return (self[b] for b in range(len(self)))
 
 
 class BasicBlocks:
     """
     Basic Blocks!
 
-    self.blocks is list of instructions chunked up in blocks. it preserves its
-    order.
+    self.blocks is list of instructions chunked up in blocks, numbered in
+    program order. blocks added later get the next free number, so the
+    layout, i.e. which block falls into which, is kept apart in self._after
+    and self._before.
 
     self.succ is cfg, self.pred contains the predecessors of the each node in
     cfg. both self.succ and self.pred is in the form of an adjacency list.
@@ -50,11 +185,24 @@ class BasicBlocks:
     self.succ may look like [[1], [0, 1]], which means block 0 flows to block 1,
     and block 1 flows to block 0 and 1.
 
-    self.dom is the dominance frontier
+    BasicBlocks takes ownership of func: the instructions in self.blocks are the
+    same dicts as in func["instrs"], so passes mutate them in place. use
+    clone() when the original has to stay untouched.
+
+    self.idom[b] is the immediate dominator of block b, or None for the entry
+    block and for unreachable blocks. self.dom[b] is the set of blocks that
+    dominate b, computed lazily from self.idom. self.loop_forest is the
+    loops.LoopForest of the cfg, also built on first use.
+
+    the cfg can be edited in place with insert_block, split_edge, redirect and
+    delete_blocks, which keep succ and pred up to date and patch or drop the
+    dominator analyses. each edit only touches the blocks around it: block
+    numbers don't move, deleted blocks stay behind as empty lists, and
+    self._labels maps every label to its block.
     """
 
     def __init__(self, func):
-        self._func = deepcopy(func)
+        self._func = func
         self.fun_args = []
         if "args" in func:
             self.fun_args = [i["name"] for i in func["args"]]
@@ -62,89 +210,192 @@ class BasicBlocks:
         self.blocks = []
         self.succ = []
         self.pred = []
-        self._gen_blocks()
+        with metrics.timer("cfg"):
+            self._gen_blocks()
         self.n = len(self.blocks)
         assert len(self.blocks) == len(self.succ) == len(self.pred)
 
-        self.dom = self._gen_dom_graph()
-        # self.dom_frontier = self._gen_dom_frontier()
-        self.dom_tree = self._gen_dom_tree()
+    def __getattr__(self, name):
+        # only called for attributes that aren't set, i.e. a dominator
+        # analysis that hasn't been computed yet or was dropped by an edit
+        if name not in _dom_attrs:
+            raise AttributeError(name)
+        if name == "loop_forest":
+            from loops import LoopForest
+
+            self.loop_forest = LoopForest(self)
+        else:
+            self._gen_dominators()
+        return self.__dict__[name]
+
+    def _gen_dominators(self):
+        with metrics.timer("dominators"):
+            self.rpo = _gen_reverse_postorder(self.succ)
+            if "idom" not in self.__dict__:  # edits can keep it up to date
+                self.idom = self._gen_idom()
+            self.dom = DomSets(self.idom)
+            self._dom_frontier = None
+            self.dom_tree = self._gen_dom_tree()
+
+    def invalidate(self, keep_idom=False):
+        """
+        call after changing self.succ or self.pred by hand. drops the
+        dominators and every analysis cached on the cfg, they're recomputed
+        when next used. keep_idom says self.idom is still right.
+        """
+        self.n = len(self.blocks)
+        for name in _dom_attrs:
+            if not (keep_idom and name == "idom"):
+                self.__dict__.pop(name, None)
 
-    def _gen_dom_graph(self):
-        succ, pred = self.succ, self.pred
-        assert len(succ) == len(pred)
-        dom = [{i for i in range(self.n)} for i in range(self.n)]
-        dom[0] = {0}
+    def _gen_idom(self):
+        """
+        Cooper, Harvey and Kennedy's "A Simple, Fast Dominance Algorithm":
+        iterate over the blocks in reverse postorder, intersecting the idom
+        chains of the already processed predecessors. the intersections walk
+        up idom chains, which is quadratic on wide joins in deep cfgs, so
+        big cfgs use Lengauer and Tarjan's algorithm instead.
+        """
+        if self.n > _lt_min_blocks:
+            return _lengauer_tarjan(self.succ, self.pred)
+        idom = [None] * self.n
+        if not self.n:
+            return idom
+
+        order = [None] * self.n
+        for i, v in enumerate(self.rpo):
+            order[v] = i
+
+        def intersect(a, b):
+            while a != b:
+                while order[a] > order[b]:
+                    a = idom[a]
+                while order[b] > order[a]:
+                    b = idom[b]
+            return a
+
+        idom[0] = 0
         changing = True
         while changing:
             changing = False
-            # for v in _gen_reverse_postorder(succ, 0):
-            for v in range(self.n):
-                if v == 0:
-                    continue
-
-                if pred[v]:
-                    update = set.intersection(*(dom[p] for p in pred[v]))
-                else:
-                    update = set()
-                update.add(v)
-
-                if update != dom[v]:
-                    dom[v] = update
-                    changing = True
+            for v in self.rpo[1:]:
+                new_idom = None
+                for p in self.pred[v]:
+                    if idom[p] is None:
+                        continue
+                    new_idom = p if new_idom is None else intersect(p, new_idom)
 
-                # for v2 in update
-                #     if v2 not in dom[v]:
-                #         changing = True
-                #         dom[v].add(v2)
-        return dom
+                if idom[v] != new_idom:
+                    idom[v] = new_idom
+                    changing = True
+        idom[0] = None
+        return idom
 
     def _is_strictly_dom(self, a, b):
-        return a in self.dom[b] and a != b
-
-    def _is_imm_dom(self, a, b):
-        for c in range(self.n):
-            if self._is_strictly_dom(a, c) and self._is_strictly_dom(c, b):
-                return False
-        return self._is_strictly_dom(a, b)
+        """
+        checks if a strictly dominates b, i.e. b sits strictly inside a's
+        subtree of the dominator tree.
+        """
+        if a == b or self._dt_pre[a] is None or self._dt_pre[b] is None:
+            return False
+        return self._dt_pre[a] < self._dt_pre[b] and self._dt_post[b] < self._dt_post[a]
 
     def _gen_dom_tree(self):
-        edges = set()
-        visited = set()
+        """
+        self.dom_children[a] lists the blocks that a immediately dominates, in
+        increasing order. also numbers the tree in pre and postorder, which
+        answers dominance queries in O(1).
 
-        def dfs(i):
-            children = []
-            if i in visited:
-                assert False, "repeating"
-            visited.add(i)
-            for j in range(self.n):
-                if self._is_imm_dom(i, j):
-                    edges.add((i, j))
-                    assert (j, i) not in edges, "not a tree, has cycle"
-                    children.append(dfs(j))
-            return (i, children)
+        returns the nested (node, children) view of the same tree, rooted at
+        the entry block.
+        """
+        self.dom_children = [[] for _ in range(self.n)]
+        for v in range(self.n):
+            if self.idom[v] is not None:
+                self.dom_children[self.idom[v]].append(v)
+
+        self._dt_pre = [None] * self.n
+        self._dt_post = [None] * self.n
+        if not self.n:
+            return (0, [])
+
+        preorder = []
+        post = 0
+        stack = [(0, iter(self.dom_children[0]))]
+        self._dt_pre[0] = 0
+        preorder.append(0)
+        while stack:
+            i, children = stack[-1]
+            for j in children:
+                self._dt_pre[j] = len(preorder)
+                preorder.append(j)
+                stack.append((j, iter(self.dom_children[j])))
+                break
+            else:
+                stack.pop()
+                self._dt_post[i] = post
+                post += 1
 
-        return dfs(0)
+        subtrees = {}
+        for i in reversed(preorder):
+            subtrees[i] = (i, [subtrees.pop(j) for j in self.dom_children[i]])
+        return subtrees[0]
+
+    @property
+    def dom_frontier(self):
+        """
+        self.dom_frontier[a] is the dominance frontier of block a. computed on
+        first use and cached until the cfg is invalidated.
+        """
+        if self._dom_frontier is None:
+            with metrics.timer("dom_frontier"):
+                self._dom_frontier = self._gen_dom_frontier()
+        return self._dom_frontier
+
+    def _gen_dom_frontier(self):
+        """
+        for every join point b, walk up the idom chain from each predecessor
+        until reaching idom(b). every block passed on the way has b in its
+        frontier. a walk stops at a block that already has b, since another
+        predecessor's walk went on from there, so this is linear in the number
+        of edges plus the size of the frontiers.
+        """
+        frontier = [set() for _ in range(self.n)]
+        for b in self.rpo:
+            for p in self.pred[b]:
+                if self.idom[p] is None and p != 0:
+                    continue  # unreachable predecessor
+                runner = p
+                while runner is not None and runner != self.idom[b]:
+                    if b in frontier[runner]:
+                        break
+                    frontier[runner].add(b)
+                    runner = self.idom[runner]
+        return frontier
 
     def compute_dom_frontier(self, a: int):
         """
         a is the index that the block corresponds to
         """
-        frontier = set()
-        for b in range(len(self.dom)):
-            if a == b:
-                continue
-            for pred in self.pred[b]:
-                if a in self.dom[pred] and not self._is_strictly_dom(a, b):
-                    frontier.add(b)
-        return frontier
+        return self.dom_frontier[a]
 
     def _add_block(self, block):
+        b = len(self.blocks)
         self.blocks.append(block)
         self.succ.append(set())
         self.pred.append(set())
+        self._after.append(None)
+        self._before.append(None)
+        for instr in block:
+            if "label" in instr:
+                self._labels[instr["label"]] = b
+        return b
 
     def _gen_blocks(self):
+        self._labels = {}
+        self._fresh = {}  # label base -> first suffix that may be free
+        self._after = []
+        self._before = []
         label_to_idx = {}
         used_labels = set()
         for instr in self.instrs:
@@ -190,6 +441,11 @@ class BasicBlocks:
                 self.pred[k].add(i)
             self.succ[i] = new
 
+        for i in range(1, len(self.blocks)):
+            self._after[i - 1] = i
+            self._before[i] = i - 1
+        self._last = len(self.blocks) - 1 if self.blocks else None
+
     def debug_print(self):
         import json
 
@@ -199,24 +455,29 @@ class BasicBlocks:
         print()
 
     def pp_dom_tree(self):
-        def dfs(tree, depth):
+        stack = [(self.dom_tree, 0)]
+        while stack:
+            tree, depth = stack.pop()
             padding = "  " * depth
             print(f"{padding}{tree[0]}")
-            for child in tree[1]:
-                dfs(child, depth + 1)
-
-        dfs(self.dom_tree, 0)
+            for child in reversed(tree[1]):
+                stack.append((child, depth + 1))
 
     def to_func(self):
         new_instrs = []
-        for block in self.blocks:
-            for i in block:
-                new_instrs.append(i)
+        b = 0 if self.blocks else None
+        while b is not None:
+            new_instrs.extend(self.blocks[b])
+            b = self._after[b]
 
-        new_func = deepcopy(self._func)
+        new_func = dict(self._func)
         new_func["instrs"] = new_instrs
         return new_func
 
+    def clone(self):
+        """returns an independent copy, sharing no instructions with self"""
+        return BasicBlocks(deepcopy(self.to_func()))
+
     def get_unreachable_blocks(self):
         unreachable_blocks = []
         for i in range(1, self.n):
@@ -225,29 +486,259 @@ class BasicBlocks:
         return unreachable_blocks
 
     def del_unreachable_blocks(self):
-        unreachable_blocks = self.get_unreachable_blocks()
-
-        for i in unreachable_blocks:
-            new_instrs = []
+        """deletes every block that can't be reached from the entry"""
+        reachable = set(_gen_reverse_postorder(self.succ))
+        dead = [i for i in range(self.n) if i not in reachable and self.blocks[i]]
+        self.delete_blocks(dead)
+        return dead
+
+    def fresh_label(self, base="b"):
+        """a label not used in the function, base if that's free"""
+        if base not in self._labels:
+            return base
+        k = self._fresh.get(base, 0)
+        while f"{base}.{k}" in self._labels:
+            k += 1
+        self._fresh[base] = k
+        return f"{base}.{k}"
+
+    def label_of(self, b):
+        """the label jumps to block b use, adding one if it has none"""
+        for instr in self.blocks[b]:
+            if "label" not in instr:
+                break
+            return instr["label"]
+        label = self.fresh_label()
+        self.blocks[b].insert(0, {"label": label})
+        self._labels[label] = b
+        return label
+
+    def _block_of(self, label):
+        return self._labels[label]
+
+    def _next(self, a):
+        """the block control falls into from the end of a, if any"""
+        return self._after[a]
+
+    def _prev(self, a):
+        return self._before[a]
+
+    def _link(self, a, b):
+        self.succ[a].add(b)
+        self.pred[b].add(a)
+
+    def _unlink(self, a, b):
+        self.succ[a].discard(b)
+        self.pred[b].discard(a)
+
+    def _reachable(self, b):
+        return b == 0 or self.idom[b] is not None
+
+    def _dominated(self, b, a):
+        """whether a dominates b, walking up the idom chain from b"""
+        while b is not None:
+            if b == a:
+                return True
+            b = self.idom[b]
+        return False
+
+    def _place(self, b, at):
+        """puts block b in the layout right before block at, or at the end"""
+        p = self._last if at is None else self._before[at]
+        self._before[b] = p
+        self._after[b] = at
+        if p is not None:
+            self._after[p] = b
+        if at is None:
+            self._last = b
+        else:
+            self._before[at] = b
+
+    def _swap(self, a, b):
+        """exchanges the numbers of blocks a and b"""
+
+        def swap(i):
+            return b if i == a else a if i == b else i
+
+        near = {a, b} | self.succ[a] | self.succ[b] | self.pred[a] | self.pred[b]
+        for i in near:
+            self.succ[i] = {swap(j) for j in self.succ[i]}
+            self.pred[i] = {swap(j) for j in self.pred[i]}
+        near = {a, b, self._after[a], self._after[b], self._before[a], self._before[b]}
+        for i in near - {None}:
+            self._after[i] = swap(self._after[i])
+            self._before[i] = swap(self._before[i])
+        self._last = swap(self._last)
+        for xs in (self.blocks, self.succ, self.pred, self._after, self._before):
+            xs[a], xs[b] = xs[b], xs[a]
+        for i in (a, b):
             for instr in self.blocks[i]:
                 if "label" in instr:
-                    new_instrs.append(instr)
-            self.blocks[i] = new_instrs
+                    self._labels[instr["label"]] = i
+        if "idom" in self.__dict__:
+            self.idom = [swap(i) for i in self.idom]
+            self.idom[a], self.idom[b] = self.idom[b], self.idom[a]
+
+    def _split_idom(self, p, new, t):
+        """patches idom for an edge p -> t that now goes p -> new -> t"""
+        if "idom" not in self.__dict__:
+            return
+        idom = self.idom
+        if not self._reachable(p):
+            return
+        idom[new] = p
+        # t's other predecessors all went through p. unless t dominates them
+        # they still meet new at p.
+        if idom[t] == p and all(
+            q == new or not self._reachable(q) or self._dominated(q, t)
+            for q in self.pred[t]
+        ):
+            idom[t] = new
+
+    def insert_block(self, instrs, at=None):
+        """
+        adds a block with instrs before block at, or at the end, and returns
+        its index, the next free one. inserting before the entry makes the
+        new block the entry, so it takes index 0 and the old entry gets the
+        next free one.
+
+        the new block goes on the fall through path: a block that fell into
+        at now falls into the new block, and the new block falls into at
+        unless instrs end in a jump. a block falling off the end of the
+        function gets an explicit ret instead. the new block is unreachable
+        otherwise, until something is redirected to it.
+        """
+        assert instrs, "blocks can't be empty, deleted blocks are"
+        assert at is None or self.blocks[at], f"block {at} is deleted"
+        p = self._last if at is None else self._before[at]
+        if at is None and p is not None and _falls_through(self.blocks[p]):
+            self.blocks[p].append({"op": "ret"})
+            p = None
+        elif p is not None and not _falls_through(self.blocks[p]):
+            p = None
+        t = at
+
+        new = self._add_block(instrs)
+        self.n += 1
+        if "idom" in self.__dict__:
+            self.idom.append(None)
+        self._place(new, at)
+
+        if p is not None:
+            if t is not None:
+                self._unlink(p, t)
+            self._link(p, new)
+        last = instrs[-1].get("op")
+        if last in ("jmp", "br"):
+            for label in instrs[-1]["labels"]:
+                self._link(new, self._block_of(label))
+        elif last != "ret" and t is not None:
+            self._link(new, t)
+
+        if t == 0:
+            # a new entry, which dominates everything through the old one
+            if "idom" in self.__dict__ and self.succ[new] == {0}:
+                self.idom[0] = new
+                self._swap(0, new)
+                self.invalidate(keep_idom=True)
+            else:
+                self._swap(0, new)
+                self.invalidate()
+            return 0
+        elif p is not None and self.succ[new] == {t}:
+            self._split_idom(p, new, t)
+            self.invalidate(keep_idom=True)
+        else:
+            # unreachable, so nothing else's dominators change
+            self.invalidate(keep_idom=p is None)
+        return new
+
+    def split_edge(self, a, b):
+        """
+        puts a new, empty block on the edge a -> b and returns its index.
+        it's placed right before b if a falls into b, else at the end.
+        """
+        assert b in self.succ[a], f"no edge {a} -> {b}"
+        label = self.fresh_label(f"{self.label_of(b)}.split")
+        if _falls_through(self.blocks[a]):
+            return self.insert_block([{"label": label}], at=b)
+
+        old_labels = {i["label"] for i in self.blocks[b] if "label" in i}
+        jmp = {"op": "jmp", "labels": [self.label_of(b)]}
+        new = self.insert_block([{"label": label}, jmp])
+        last = self.blocks[a][-1]
+        labels = [label if l in old_labels else l for l in last["labels"]]
+        self.blocks[a][-1] = dict(last, labels=labels)
+        self._unlink(a, b)
+        self._link(a, new)
+        self._split_idom(a, new, b)
+        self.invalidate(keep_idom=True)
+        return new
+
+    def redirect(self, a, old, new):
+        """
+        makes the edge a -> old go to new instead, rewriting a's jump or
+        adding one if a fell into old. a br whose targets end up the same
+        becomes a jmp, and a jmp to the next block is dropped.
+        """
+        assert old in self.succ[a], f"no edge {a} -> {old}"
+        block = self.blocks[a]
+        target = self.label_of(new)
+        last = block[-1]
+        if last.get("op") in ("jmp", "br"):
+            old_labels = {i["label"] for i in self.blocks[old] if "label" in i}
+            labels = [target if l in old_labels else l for l in last["labels"]]
+            if len(set(labels)) == 1:
+                block[-1] = {"op": "jmp", "labels": labels[:1]}
+            else:
+                block[-1] = dict(last, labels=labels)
+            if block[-1]["op"] == "jmp" and self._next(a) == new:
+                block.pop()
+        elif self._next(a) != new:
+            block.append({"op": "jmp", "labels": [target]})
+
+        self._unlink(a, old)
+        self._link(a, new)
+        self.invalidate()
+
+    def delete_blocks(self, blocks):
+        """
+        deletes blocks that only they themselves jump into, i.e. dead code.
+        the rest of the cfg, dominators included, stays valid.
+        """
+        blocks = set(blocks)
+        assert 0 not in blocks, "can't delete the entry"
+        for b in blocks:
+            assert self.pred[b] <= blocks, f"block {b} is still reachable"
+        for b in blocks:
+            for s in self.succ[b]:
+                self.pred[s].discard(b)
+            self.succ[b] = set()
+            for instr in self.blocks[b]:
+                if "label" in instr:
+                    del self._labels[instr["label"]]
+            self.blocks[b] = []
+            p, a = self._before[b], self._after[b]
+            if p is not None:
+                self._after[p] = a
+            if a is not None:
+                self._before[a] = p
+            else:
+                self._last = p
+            self._before[b] = self._after[b] = None
+        # the blocks were unreachable, so no dominator analysis saw them
 
     def assert_reachable_in_dt(self):
         unreachable = self.get_unreachable_blocks()
 
         visited = set()
-
-        def dfs(dt):
-            if dt[0] in visited:
-                return
-
-            visited.add(dt[0])
-            for j in dt[1]:
-                dfs(j)
-
-        dfs(self.dom_tree)
+        stack = [0] if self.n else []
+        while stack:
+            i = stack.pop()
+            if i in visited:
+                continue
+            visited.add(i)
+            stack.extend(self.dom_children[i])
 
         for i in range(self.n):
             if i not in unreachable:
@@ -257,386 +748,480 @@ class BasicBlocks:
             #     print("dom_tree:", self.dom_tree)
             #     assert i not in visited, f"block {i} is unreachable but is in dt"
 
-    def to_ssa(self):
-        return self._to_ssa2()
-
-    def _to_ssa2(self):
+    def to_ssa(self, mode="pruned"):
         """
-        FIRST PASS. Find blocks where each var is assigned
+        puts the function in SSA form, with a get at the top of a block for
+        each of its phis and a set in each predecessor. mode picks where phis
+        go, among the blocks in the iterated dominance frontier of a
+        variable's defs:
+
+            minimal      every one of them
+            semi_pruned  only for variables read in some block before
+                         they're assigned there, i.e. live across blocks
+            pruned       only where the variable is live on entry
+
+        a variable that is undefined on some path into a phi gets a single
+        undef at the entry.
         """
-        defs = {}  # blocks where v is assigned
-        for v in self.fun_args:
-            defs[v] = [0]
+        assert mode in SSA_MODES, f"unknown SSA mode {mode!r}"
+        with metrics.timer("to_ssa"):
+            self._to_ssa(mode)
+
+    def _to_ssa(self, mode):
+        if not self.n:
+            return
+        if self.pred[0]:
+            # the entry has no predecessor to set its phis, so give the
+            # function one that does
+            self.insert_block([{"label": self.fresh_label("entry")}], at=0)
+
+        # FIRST PASS: the blocks where each var is assigned, and its type
+        defs = {v: {0} for v in self.fun_args}
+        types = {}
+        exposed = set()  # read in some block before being assigned there
         for i, b in enumerate(self.blocks):
+            assigned = set()
             for instr in b:
-                if "dest" not in instr:
-                    continue
-                dest = instr["dest"]
-                if dest not in defs:
-                    defs[dest] = []
+                for arg in instr.get("args", ()):
+                    if arg not in assigned:
+                        exposed.add(arg)
+                if "dest" in instr:
+                    defs.setdefault(instr["dest"], set()).add(i)
+                    assigned.add(instr["dest"])
+                    if "type" in instr:
+                        types[instr["dest"]] = instr["type"]
 
-                if i not in defs[dest]:
-                    defs[dest].append(i)
+        if mode == "pruned":
+            from dataflow import Liveness, dataflow
 
-        """
-        SECOND PASS: INSERT PHI NODES
-        """
-        df = [self.compute_dom_frontier(i) for i in range(self.n)]
-        phi_nodes = [{} for _ in range(self.n)]
+            live_in, _ = dataflow(self, Liveness)
 
-        counts = {}
-        for v in defs:
-            for d in defs[v]:
-                for b in df[d]:
-                    if v not in phi_nodes[b]:
-                        counts[v] = 1 + counts.get(v, -1)
-                        phi_nodes[b][v] = v + "." + str(counts[v])
-                    if b not in defs[v]:
-                        defs[v].append(b)
+            def wanted(v, b):
+                return v in live_in[b]
 
-        """
-        THIRD PASS: rename
-        """
-        visited = set()
+        elif mode == "semi_pruned":
 
-        def rename(dt, stack):
-            b = dt[0]
-            if b in visited:
-                assert False, "revisiting b???"
-            visited.add(b)
+            def wanted(v, b):
+                return v in exposed
 
-            stack = stack.copy()
+        else:
 
-            get_instrs = []
-            for v in phi_nodes[b]:
-                get_instrs.append({"dest": phi_nodes[b][v], "op": "get"})
-                stack[v] = phi_nodes[b][v]
-            if "label" in self.blocks[b][0]:
-                self.blocks[b] = [self.blocks[b][0]] + get_instrs + self.blocks[b][1:]
-            else:
-                self.blocks[b] = get_instrs + self.blocks[b]
-
-            for instr in self.blocks[b]:
-                if instr.get("op", None) == "get":
-                    continue
+            def wanted(v, b):
+                return True
 
+        # SECOND PASS: place phis on the iterated dominance frontiers
+        df = self.dom_frontier
+        phi_nodes = [{} for _ in range(self.n)]  # block -> {var: phi name}
+        counts = {}
+        for v, blocks in defs.items():
+            work = list(blocks)
+            while work:
+                d = work.pop()
+                for b in df[d]:
+                    if v in phi_nodes[b] or not wanted(v, b):
+                        continue
+                    counts[v] = counts.get(v, -1) + 1
+                    phi_nodes[b][v] = f"{v}.{counts[v]}"
+                    if b not in blocks:
+                        blocks.add(b)
+                        work.append(b)
+        metrics.count("to_ssa.phis", sum(map(len, phi_nodes)))
+
+        # THIRD PASS: rename along the dominator tree. names[v] is the stack
+        # of v's names in the dominating blocks, the top one reaches here.
+        names = {v: [v] for v in self.fun_args}
+        undefined = set()
+
+        def current(v):
+            stack = names.get(v)
+            return stack[-1] if stack else None
+
+        def rename(b):
+            pushed = []  # one entry per name pushed, popped after b's subtree
+
+            def push(v, name):
+                names.setdefault(v, []).append(name)
+                pushed.append(v)
+
+            block = self.blocks[b]
+            k = 0
+            while k < len(block) and "label" in block[k]:
+                k += 1
+            gets = []
+            for v, phi in phi_nodes[b].items():
+                gets.append({"dest": phi, "op": "get", **_typed(types, v)})
+                push(v, phi)
+            block[k:k] = gets
+
+            for instr in block[k + len(gets) :]:
                 if "args" in instr:
-                    # print("stack:", stack)
-                    for v in instr["args"]:
-                        if v not in stack:
-                            print(f"FAILED: instr = {instr}, v = {v}")
-                            assert False
-                    instr["args"] = [stack[v] for v in instr["args"]]
+                    instr["args"] = [current(v) or v for v in instr["args"]]
                 if "dest" in instr:
                     dest = instr["dest"]
                     counts[dest] = counts.get(dest, -1) + 1
                     instr["dest"] = f"{dest}.{counts[dest]}"
-                    stack[dest] = instr["dest"]
+                    push(dest, instr["dest"])
 
-            set_instrs = []
+            sets = []
             for s in self.succ[b]:
-                for p in phi_nodes[s]:
-                    if b not in defs[p]:
-                        continue
-                    if p not in stack:
-                        print(
-                            f"FAILED: stack = {stack}, p = {p}, s = {s}, phi_nodes[{s}] = {phi_nodes[s]}"
-                        )
-                        assert False
-                    set_instrs.append(
-                        {"op": "set", "args": [phi_nodes[s][p], stack[p]]}
-                    )
-            if self.blocks[b][-1].get("op", None) in ["jmp", "br"]:
-                self.blocks[b] = self.blocks[b][:-1] + set_instrs + [self.blocks[b][-1]]
+                for v, phi in phi_nodes[s].items():
+                    name = current(v)
+                    if name is None:
+                        undefined.add(v)
+                        name = v
+                    sets.append({"op": "set", "args": [phi, name]})
+            if block and block[-1].get("op") in ("jmp", "br"):
+                block[-1:-1] = sets
             else:
-                self.blocks[b].extend(set_instrs)
-
-            for dt2 in dt[1]:
-                rename(dt2, stack)
-
-        rename(self.dom_tree, {v: v for v in self.fun_args})
+                block.extend(sets)
+            return pushed
+
+        # preorder walk with an explicit stack, popping each block's names
+        # once its subtree is done
+        work = [(self.dom_tree, None)]
+        while work:
+            node, pushed = work.pop()
+            if pushed is not None:
+                for v in pushed:
+                    names[v].pop()
+                continue
+            b, children = node
+            work.append((node, rename(b)))
+            work.extend((child, None) for child in reversed(children))
+
+        # original names are all renamed away, so they're free to hold undef
+        undefs = [
+            {"dest": v, "op": "undef", **_typed(types, v)} for v in sorted(undefined)
+        ]
+        k = 0
+        while k < len(self.blocks[0]) and "label" in self.blocks[0][k]:
+            k += 1
+        self.blocks[0][k:k] = undefs
 
+    def from_ssa(self):
         """
-        ADD A BUNCH OF UNDEFS
+        takes the function out of SSA form. the sets become parallel copies
+        on the cfg edges, and a critical edge is split only if one of its
+        copies survives coalescing. copies between names that don't interfere
+        are coalesced away by giving both the same name, and the rest are
+        ordered into ids, with a temporary to break cycles.
         """
-        undef_instrs = []
-        undefed = set()
-        for i in range(self.n):
-            for v in phi_nodes[i]:
-                if v not in self.fun_args and v not in undefed:
-                    undef_instrs.append({"dest": v, "op": "undef"})
-                    undefed.add(v)
-                undef_instrs.append({"op": "set", "args": [phi_nodes[i][v], v]})
-        self.blocks[0] = undef_instrs + self.blocks[0]
-
-    def _to_ssa1(self):
-        count = {}
-
-        dfs = [self.compute_dom_frontier(i) for i in range(self.n)]
-        sets = [
-            {} for _ in range(self.n)
-        ]  # sets[i]["name"] = "name.3" means we need to set "name" name.3
-        phi_nodes = [{} for _ in range(self.n)]
-
-        all_vars = {}
-        for b in self.blocks:
-            for instr in b:
-                if "dest" in instr:
-                    assert "type" in instr, instr
-                    if instr["dest"] not in self.fun_args:
-                        all_vars[instr["dest"]] = instr["type"]
-
-        # prepend = [{"dest": "undef", "op": "undef"}
-        prepend = []
-        for var in all_vars:
-            prepend.append({"dest": var, "op": "undef", "type": all_vars[var]})
+        with metrics.timer("from_ssa"):
+            self._from_ssa()
 
+    def _from_ssa(self):
+        types = {a["name"]: a["type"] for a in self._func.get("args", ())}
+        phi_block = {}
         for i, b in enumerate(self.blocks):
-            sets = {}
             for instr in b:
-                if "dest" not in instr:
-                    continue
-
-                dest = instr["dest"]
-                count[dest] = count.get(dest, -1) + 1
-                instr["dest"] += "." + str(count[dest])
-                sets[dest] = instr
-
-            for j in dfs[i]:
-                for dest in sets:
-                    if dest not in phi_nodes[j]:
-                        count[dest] = count.get(dest, -1) + 1
-                        phi_nodes[j][dest] = {
-                            "dest": dest + "." + str(count[dest]),
-                            "args": [],
-                        }
-                    phi_nodes[j][dest]["args"].append(sets[dest]["dest"])
-                    if "type" in sets[dest]:
-                        phi_nodes[j][dest]["type"] = sets[dest]["type"]
-
-                    set_instr = {
-                        "op": "set",
-                        "args": [phi_nodes[j][dest]["dest"], sets[dest]["dest"]],
-                    }
-                    if b and b[-1].get("op", None) in ["br", "jmp"]:
-                        b.insert(-1, set_instr)
-
-                    else:
-                        b.append(set_instr)
-
-        for i in range(self.n):
-            for dest in phi_nodes[i]:
-                prepend.append(
-                    {"op": "set", "args": [phi_nodes[i][dest]["dest"], dest]}
-                )
-
+                if "type" in instr and "dest" in instr:
+                    types[instr["dest"]] = instr["type"]
+                if instr.get("op") == "get":
+                    phi_block[instr["dest"]] = i
+
+        # the sets of each edge, as a parallel copy {phi: value}. a set for a
+        # block that isn't a successor (anymore) can't be read, drop it.
+        edge_copies = {}
         for i, b in enumerate(self.blocks):
-            get_instrs = []
-            # defined = set()
-            for dest in phi_nodes[i]:
-                get_dest = phi_nodes[i][dest]
-                # if get_dest not in defined:
-                #             get_instrs.append({"op": "set", "args": [get_dest, "undefundefundefundefundef"]})
-                get_instr = {"dest": get_dest["dest"], "op": "get"}
-                if "type" in get_dest:
-                    get_instr["type"] = get_dest["type"]
-                get_instrs.append(get_instr)
-            #         defined.add(get_dest)
-            #     for instr in b:
-            #         if "dest" in instr:
-            #             defined.add(instr["dest"])
-
-            if self.blocks[i]:
-                if "label" in self.blocks[i][0]:
-                    self.blocks[i] = (
-                        [self.blocks[i][0]] + get_instrs + self.blocks[i][1:]
-                    )
-                else:
-                    self.blocks[i] = get_instrs + self.blocks[i]
-        #     self.blocks[i].insert(0, {"dest": "undefundefundefundefundef", "op": "undef"})
-
-        # if debug_mode:
-        #     print(phi_nodes)
-        #     for i in range(self.n):
-        #         for j in phi_nodes[i]:
-        #             print(phi_nodes[i][j]["dest"])
-        #             # print(j, j["dest"])
-
-        def find(arg, var_stack):
-            for d in reversed(var_stack):
-                # print(d)
-                # print("d:", d, "arg:", arg)
-                if arg in d:
-                    return d[arg]
-            assert False, f"{arg} not found in {var_stack}"
-            # return arg
-
-        def trim(s):
-            for i in range(len(s) - 1, -1, -1):
-                if s[i] == ".":
-                    return s[:i]
-            # if s in ["undefundefundefundefundef"] + [self.fun_args]:
-            #     return s
-            assert s in self.fun_args, f"{s}, {self.fun_args}"
-            return s
-            # assert False, f"failed trim on {s}"
-
-        visited = set()
-
-        def rename_args(i, var_stack=None):
-            if i in visited:
-                return
-            visited.add(i)
-
-            if var_stack is None:
-                var_stack = []
-
-            if debug_mode:
-                print("var_stack: ", var_stack)
-
-            var_stack.append({})
-            # print(f"\nBlock {i}: ")
-            for instr in self.blocks[i]:
-                # print("instr:", instr)
-                # print("var_stack:", var_stack)
-                if "args" in instr:
-                    if instr.get("op", None) == "set":
-                        continue
-                    instr["args"] = [find(arg, var_stack) for arg in instr["args"]]
-                if "dest" in instr:
-                    var_stack[-1][trim(instr["dest"])] = instr["dest"]
-            #     if debug_mode:
-            #         print("var_stack: ", var_stack)
-
-            for child in self.succ[i]:
-                rename_args(child, var_stack)
-            var_stack.pop()
-
-        # # print(self._func["args"])
-        # var_stack = [None]
-        # # print(self.fun_args)
-        # var_stack[-1] = {i: i for i in self.fun_args}
-        # print(f"fun_args: {self.fun_args}")
-        var_stack = [{i: i for i in self.fun_args}]
-
-        # for i in self._func["args"]:
-        # #     var_stack[-1][i["name"]] = i["name"]
-        # # print(var_stack)
-        for i in range(self.n):
-            rename_args(i, var_stack)
-
-        self.blocks[0] = prepend + self.blocks[0]
-        # print(self.dom_tree, visited)
-        # for i in range(self.n):
-        #     if i not in visited:
-        #         assert False, f"block {i} not visited"
-
-    def from_ssa(self):
-        for i, b in enumerate(self.blocks):
-            self.blocks[i] = [instr for instr in b if instr.get("op", None) != "get"]
-            assert all("get" not in instr for instr in b)
-
-            # print("hello:", self.blocks[i])
-            # print(self.blocks[i])
-            for instr in self.blocks[i]:
-                if "op" not in instr:
-                    continue
-                if instr["op"] == "set":
-                    instr["op"] = "id"
-                    instr["dest"] = instr["args"][0]
-                    instr["args"] = [instr["args"][1]]
-
-    def to_ssa_archive(self):
-        count = {}
-        # gets[3]["name"] = "name.v1" means
-
-        dfs = [
-            self.compute_dom_frontier(i) for i in range(self.n)
-        ]  # dominance frontiers
+            kept = []
+            for instr in b:
+                op = instr.get("op")
+                if op == "set":
+                    phi, value = instr["args"]
+                    s = phi_block.get(phi)
+                    if s in self.succ[i]:
+                        edge_copies.setdefault((i, s), {})[phi] = value
+                elif op != "get":
+                    kept.append(instr)
+            self.blocks[i] = kept
+            if b and not kept:
+                self.label_of(i)  # an empty block would count as deleted
+
+        # a copy goes at the end of its predecessor, unless that has more
+        # successors. then the edge is split, but only if some copy on it
+        # survives coalescing.
+        pcopy = {}  # block or critical edge -> [(dest, src)]
+        for (b, s), copies in edge_copies.items():
+            pcopy[b if len(self.succ[b]) == 1 else (b, s)] = list(copies.items())
+
+        fun_args = [a["name"] for a in self._func.get("args", ())]
+        find = _coalesce(self, pcopy, fun_args).name
 
         for i, b in enumerate(self.blocks):
-            df = dfs[i]
-
+            kept = []
             for instr in b:
-                if "dest" not in instr:
-                    continue
-
-                dest = instr["dest"]
-
-                count[dest] = count.get(dest, -1) + 1
-                instr["dest"] += "." + str(count[dest])
-
-                # if dest not in sets[i]:
-                #     sets[i][dest] = instr["dest"]
-                sets[i][dest] = instr["dest"]
-
-                for j in df:
-                    if dest not in gets[j]:
-                        count[dest] += 1
-                        gets[j][dest] = dest + "." + str(count[dest])
-
-        # for i in range(self.n):
-        #     print(f"block {i}")
-        #     print(f"  df {dfs[i]}")
-        #     print(f"  gets = {gets[i]}")
-        #     print(f"  succ = {self.succ[i]}")
-        #     print(f"  pred = {self.pred[i]}")
-        #     print(f"  instrs = ")
-        #     for j in self.blocks[i]:
-        #         print(f"    {j}")
-        # print(self.blocks[i])
-
-        def trim(s):
-            for i in range(len(s) - 1, -1, -1):
-                if s[i] == ".":
-                    return s[:i]
-            assert False, "failed trim"
-
-        q = deque([0])
-        visited = [False] * self.n
-        # for i, b in enumerate(self.blocks):
-        env = {x["name"]: x["name"] for x in self._func["args"]}
-        while q:
-            i = q.popleft()
-            if visited[i]:
+                if "args" in instr:
+                    instr["args"] = [find(a) for a in instr["args"]]
+                if "dest" in instr:
+                    instr["dest"] = find(instr["dest"])
+                    if instr["op"] == "id" and instr["args"][0] == instr["dest"]:
+                        continue
+                kept.append(instr)
+            self.blocks[i] = kept
+            if not kept:
+                self.label_of(i)
+
+        temps = []  # (name, type), one temporary per type for copy cycles
+
+        def temp(v):
+            t = types.get(v)
+            for name, ty in temps:
+                if ty == t:
+                    return name
+            name = self._temp(types, {name for name, _ in temps})
+            temps.append((name, t))
+            if t is not None:
+                types[name] = t
+            return name
+
+        coalesced = 0
+        for site, copies in pcopy.items():
+            copies = [(find(d), find(s)) for d, s in copies]
+            pending = [(d, s) for d, s in copies if d != s]
+            coalesced += len(copies) - len(pending)
+            if not pending:
                 continue
-            visited[i] = True
-
-            for j in self.succ[i]:
-                q.append(j)
-
-            b = self.blocks[i]
-
-            df = dfs[i]
-
-            new_instrs = []
-            for k, v in gets[i].items():
-                new_instrs.append({"dest": v, "op": "get"})
-                env[k] = v
-
-            # print(env)
+            ids = [
+                {"dest": d, **_typed(types, d), "op": "id", "args": [s]}
+                for d, s in _sequentialize(pending, temp)
+            ]
+            # split edges are appended, so the numbers of blocks stay put
+            b = site if isinstance(site, int) else self.split_edge(*site)
+            block = self.blocks[b]
+            if block[-1].get("op") in ("jmp", "br"):
+                block[-1:-1] = ids
+            else:
+                block.extend(ids)
+        metrics.count("from_ssa.coalesced", coalesced)
+
+    def _temp(self, types, taken=()):
+        used = {
+            name
+            for b in self.blocks
+            for instr in b
+            for name in [instr.get("dest"), *instr.get("args", ())]
+        }
+        name = "tmp"
+        k = 0
+        while name in used or name in types or name in taken:
+            name = f"tmp.{k}"
+            k += 1
+        return name
+
+
+class _UnionFind:
+    """
+    disjoint sets of variables, with path halving and union by rank. a set
+    goes by the name of one of its members, picked by union.
+    """
 
-            for instr in b:
-                new_instrs.append(instr)
-                if "args" in instr:
-                    instr["args"] = [env[x] for x in instr["args"]]
+    def __init__(self):
+        self.parent = {}
+        self.rank = {}
+        self.names = {}  # root -> its set's name, where that isn't the root
 
-                if "dest" not in instr:
-                    continue
+    def find(self, v):
+        parent = self.parent
+        while True:
+            p = parent.get(v, v)
+            if p == v:
+                return v
+            parent[v] = v = parent.get(p, p)
 
-                dest = instr["dest"]
-                orig = trim(dest)
-                env[orig] = dest
-                # print(orig, dest)
+    def name(self, v):
+        root = self.find(v)
+        return self.names.get(root, root)
 
-                if sets[i][orig] == dest:
-                    for j in df:
-                        new_instrs.append({"op": "set", "args": [gets[j][orig], dest]})
+    def union(self, a, b, name):
+        """
+        merges the sets of a and b into one called name. returns the new
+        root and the old one that went under it.
+        """
+        a, b = self.find(a), self.find(b)
+        rank_a, rank_b = self.rank.get(a, 0), self.rank.get(b, 0)
+        if rank_a < rank_b:
+            a, b = b, a
+        elif rank_a == rank_b:
+            self.rank[a] = rank_a + 1
+        self.parent[b] = a
+        self.names.pop(b, None)
+        if name == a:
+            self.names.pop(a, None)
+        else:
+            self.names[a] = name
+        return a, b
+
+
+def _copy_liveness(bb, pcopy):
+    """
+    live in and out sets of every block, where pcopy[b] is a parallel copy
+    at the end of block b, right before its terminator, and pcopy[(b, s)] one
+    on the edge b -> s
+    """
+    n = bb.n
+    use = [set() for _ in range(n)]
+    defs = [set() for _ in range(n)]
+    for i, b in enumerate(bb.blocks):
+        u, d = use[i], defs[i]
+        body = b
+        term = None
+        if b and b[-1].get("op") in _terminators:
+            body, term = b[:-1], b[-1]
+        for instr in body:
+            u.update(a for a in instr.get("args", ()) if a not in d)
+            if "dest" in instr:
+                d.add(instr["dest"])
+        u.update(src for _, src in pcopy.get(i, ()) if src not in d)
+        d.update(dest for dest, _ in pcopy.get(i, ()))
+        if term is not None:
+            u.update(a for a in term.get("args", ()) if a not in d)
+
+    def through(i, s):
+        copies = pcopy.get((i, s))
+        if copies is None:
+            return live_in[s]
+        return (live_in[s] - {d for d, _ in copies}) | {src for _, src in copies}
+
+    live_in = [set() for _ in range(n)]
+    live_out = [set() for _ in range(n)]
+    reachable = set(bb.rpo)
+    order = bb.rpo[::-1] + [i for i in range(n) if i not in reachable]
+    changing = True
+    while changing:
+        changing = False
+        for i in order:
+            out = set()
+            for s in bb.succ[i]:
+                out |= through(i, s)
+            live_out[i] = out
+            new_in = use[i] | (out - defs[i])
+            if new_in != live_in[i]:
+                live_in[i] = new_in
+                changing = True
+    return live_in, live_out
+
+
+def _coalesce(bb, pcopy, fun_args):
+    """
+    builds the interference graph and merges the two sides of every copy
+    that don't interfere. returns the _UnionFind of the merged names.
+    """
+    sets = _UnionFind()
+    if not pcopy:
+        return sets
+    live_in, live_out = _copy_liveness(bb, pcopy)
+    adj = defaultdict(set)
+    # only edges between variables of copies can keep a copy from going away
+    related = set(fun_args)
+    for copies in pcopy.values():
+        for d, src in copies:
+            related.add(d)
+            related.add(src)
+
+    def interfere(a, b):
+        if a != b:
+            adj[a].add(b)
+            adj[b].add(a)
+
+    def define(dest, live, src=None):
+        if dest in related:
+            for v in live & related:
+                if v != src:
+                    interfere(dest, v)
+
+    def copy(copies, live):
+        dests = [d for d, _ in copies]
+        for d, src in copies:
+            define(d, live, src)
+        for d in dests:
+            for e in dests:
+                interfere(d, e)  # written at once, they need their own names
+        live.difference_update(dests)
+        live.update(src for _, src in copies)
+
+    for site, copies in pcopy.items():
+        if not isinstance(site, int):
+            copy(copies, set(live_in[site[1]]))
+
+    for i, b in enumerate(bb.blocks):
+        live = set(live_out[i])
+        body = b
+        if b and b[-1].get("op") in _terminators:
+            body = b[:-1]
+            live.update(b[-1].get("args", ()))
+        copy(pcopy.get(i, ()), live)
+        for instr in reversed(body):
+            if "dest" in instr:
+                src = instr["args"][0] if instr.get("op") == "id" else None
+                define(instr["dest"], live, src)
+                live.discard(instr["dest"])
+            live.update(instr.get("args", ()))
+    for a in fun_args:
+        define(a, live_in[0] if bb.n else ())
+        for b in fun_args:
+            interfere(a, b)
+
+    # roots stand for their whole set in adj
+    args = set(fun_args)
+    for copies in pcopy.values():
+        for d, src in copies:
+            a, b = sets.find(d), sets.find(src)
+            if a == b or b in adj[a]:
+                continue
+            name = sets.name(src)
+            if name not in args:  # parameters keep their names
+                name = sets.name(d)
+            root, other = sets.union(a, b, name)
+            for v in adj.pop(other, ()):
+                adj[v].discard(other)
+                interfere(root, v)
+    return sets
 
-            self.blocks[i] = new_instrs
 
-    # def from_ssa(self):
-    #     pass
+def _sequentialize(copies, temp):
+    """
+    orders a parallel copy [(dest, src)] with distinct dests into a list of
+    sequential ones. a cycle of copies is broken with a temporary, temp(v)
+    for a variable v on it, so each cycle costs a single extra copy.
+    """
+    pred = {}  # dest -> the src it wants
+    loc = {}  # src -> where its original value is now
+    for d, s in copies:
+        pred[d] = s
+        loc[s] = s
+    ready = [d for d in pred if d not in loc]  # no one needs their old value
+    todo = list(pred)
+    done = set()
+    out = []
+    while todo:
+        while ready:
+            b = ready.pop()
+            a = pred[b]
+            c = loc[a]
+            out.append((b, c))
+            done.add(b)
+            loc[a] = b
+            if a == c and a in pred:
+                ready.append(a)
+        b = todo.pop()
+        if b not in done:
+            # b is in a cycle, save its value so it can be overwritten
+            tmp = temp(b)
+            out.append((tmp, b))
+            loc[b] = tmp
+            ready.append(b)
+    return out
+
+
+def to_ssa(bb, mode="pruned"):
+    """BasicBlocks.to_ssa as a pass, i.e. returning the BasicBlocks"""
+    bb.to_ssa(mode)
+    return bb
+
+
+def from_ssa(bb):
+    bb.from_ssa()
+    return bb
 
 
 if __name__ == "__main__":
@@ -657,7 +1242,6 @@ if __name__ == "__main__":
         # print("dom tree:", bb.dom_tree)
         # bb.pp_dom_tree()
         print(bb.dom_tree)
-        dfs = [bb.compute_dom_frontier(i) for i in range(bb.n)]
-        print("dfs:", dfs)
+        print("dfs:", bb.dom_frontier)
         print()
         # bb.debug_print()
@@ -1,90 +1,329 @@
-import json
-import sys
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Union, assert_never
-from enum import Enum, auto
+"""
+Compact in-memory representation of Bril programs.
 
-binop = ""
-# class Type(Enum):
-#     INT: str = "int"
-#     BOOL: str = "bool"
+The json form keeps every instruction as a dict keyed by strings, so every
+visit pays for "dest" in instr, instr.get("op") and friends. Here opcodes and
+variable names are interned to small ints, and instructions are __slots__
+objects:
 
+    prog = from_json(json.load(sys.stdin))
+    for func in prog.functions:
+        for instr in func.instrs:
+            if instr.op == CONST:
+                ...
+    print(json.dumps(to_json(prog)))
 
-# class Op(Enum):
-#     ADD: str = "add"
-#     MUL: str = "mul"
-#     SUB: str = "sub"
-#     DIV: str = "div"
-#     EQ = "eq"
-#     LT = "lt"
-#     GT = "gt"
-#     LE = "le"
-#     GE = "ge"
-#     NOT = "not"
-#     AND = "and"
-#     OR = "or"
-#     JMP = "jmp"
-#     BR = "br"
-#     CALL = "call"
-#     RET = "ret"
-#     ID = "id"
-#     PRINT = "print"
-#     NOP = "nop"
+Variable ids are per function, see Function.vars. Keys this module doesn't
+know about (e.g. "pos") are carried along in .extra, so to_json(from_json(d))
+== d.
+"""
 
+from typing import Optional
 
-# @dataclass
-# class Label:
-#     label: str
 
+class Interner:
+    """two way mapping between strings and dense ids 0, 1, 2, ..."""
 
-# @dataclass
-# class Instruction:
-#     op: str
-#     dest: Optional[str]
-#     type: Optional[Type]
-#     args: Optional[List[str]]
-#     funcs: Optional[List[str]]
-#     labels: Optional[List[str]]
+    __slots__ = ("ids", "names")
 
+    def __init__(self, names=()):
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+        for name in names:
+            self.intern(name)
 
-# Literal = int | str
+    def intern(self, name: str) -> int:
+        i = self.ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self.ids[name] = i
+            self.names.append(name)
+        return i
 
+    def name(self, i: int) -> str:
+        return self.names[i]
 
-# @dataclass
-# class Constant(Instruction):
-#     op: Op
-#     dest: str
-#     type: Type
-#     value: Literal
+    def get(self, name: str) -> Optional[int]:
+        return self.ids.get(name)
 
+    def __contains__(self, name) -> bool:
+        return name in self.ids
 
-# class Value(Instruction):
-#     op: Op
-#     dest: str
-#     type: Type
+    def __len__(self) -> int:
+        return len(self.names)
 
 
-# @dataclass
-# class FunctionArg:
-#     name: str
-#     type: Type
+# opcodes are shared by every program. ops outside the core set (memory, float,
+# speculation, ...) are interned on first sight.
+opcodes = Interner(
+    [
+        "label",
+        "const",
+        "id",
+        "add",
+        "sub",
+        "mul",
+        "div",
+        "eq",
+        "lt",
+        "gt",
+        "le",
+        "ge",
+        "not",
+        "and",
+        "or",
+        "jmp",
+        "br",
+        "call",
+        "ret",
+        "print",
+        "nop",
+        "get",
+        "set",
+        "undef",
+    ]
+)
 
+(
+    LABEL,
+    CONST,
+    ID,
+    ADD,
+    SUB,
+    MUL,
+    DIV,
+    EQ,
+    LT,
+    GT,
+    LE,
+    GE,
+    NOT,
+    AND,
+    OR,
+    JMP,
+    BR,
+    CALL,
+    RET,
+    PRINT,
+    NOP,
+    GET,
+    SET,
+    UNDEF,
+) = range(len(opcodes))
 
-# @dataclass
-# class Function:
-#     name: str
-#     args: Optional[List[FunctionArg]]
-#     type: Optional[Type]
-#     instrs: List[Instruction | Label]
+_instr_keys = {"op", "dest", "type", "args", "funcs", "labels", "value"}
+_func_keys = {"name", "args", "type", "instrs"}
 
 
-# class Bril:
-#     functions: List[Function]
+class Label:
+    __slots__ = ("label", "extra")
 
+    # lets passes dispatch on .op without an isinstance check
+    op = LABEL
+    dest = None
+    args = None
 
-# def from_json(d):
-#     assert False, "todo"
+    def __init__(self, label: str, extra: Optional[dict] = None):
+        self.label = label
+        self.extra = extra
 
+    def __repr__(self):
+        return f"Label({self.label!r})"
 
-# def to_json(s):
-#     assert False, "todo"
+
+class Instr:
+    """
+    op is an opcode id, dest an id into the function's vars (or None) and args
+    a tuple of var ids. funcs and labels stay strings. attributes that were
+    absent from the json are None.
+    """
+
+    __slots__ = ("op", "dest", "type", "args", "funcs", "labels", "value", "extra")
+
+    def __init__(
+        self,
+        op: int,
+        dest: Optional[int] = None,
+        type=None,
+        args: Optional[tuple] = None,
+        funcs: Optional[tuple] = None,
+        labels: Optional[tuple] = None,
+        value=None,
+        extra: Optional[dict] = None,
+    ):
+        self.op = op
+        self.dest = dest
+        self.type = type
+        self.args = args
+        self.funcs = funcs
+        self.labels = labels
+        self.value = value
+        self.extra = extra
+
+    def __repr__(self):
+        fields = [opcodes.name(self.op)]
+        for slot in Instr.__slots__[1:]:
+            v = getattr(self, slot)
+            if v is not None:
+                fields.append(f"{slot}={v!r}")
+        return f"Instr({', '.join(fields)})"
+
+
+class Function:
+    __slots__ = ("name", "args", "type", "instrs", "vars", "extra")
+
+    def __init__(self, name, args, type, instrs, vars, extra=None):
+        self.name: str = name
+        # list of (var id, type, extra), or None if the json had no "args"
+        self.args: Optional[list] = args
+        self.type = type
+        self.instrs: list = instrs
+        self.vars: Interner = vars
+        self.extra: Optional[dict] = extra
+
+
+class Program:
+    __slots__ = ("functions", "extra")
+
+    def __init__(self, functions, extra=None):
+        self.functions: list[Function] = functions
+        self.extra: Optional[dict] = extra
+
+
+def _extra(d, known):
+    extra = {k: v for k, v in d.items() if k not in known}
+    return extra or None
+
+
+def instr_from_json(d: dict, vars: Interner):
+    if "label" in d:
+        return Label(d["label"], _extra(d, {"label"}))
+
+    intern = vars.intern
+    dest = d.get("dest")
+    args = d.get("args")
+    funcs = d.get("funcs")
+    labels = d.get("labels")
+    return Instr(
+        opcodes.intern(d["op"]),
+        None if dest is None else intern(dest),
+        d.get("type"),
+        None if args is None else tuple(intern(a) for a in args),
+        None if funcs is None else tuple(funcs),
+        None if labels is None else tuple(labels),
+        d.get("value"),
+        _extra(d, _instr_keys),
+    )
+
+
+def instr_to_json(instr, vars: Interner) -> dict:
+    if instr.op == LABEL:
+        d = {"label": instr.label}
+    else:
+        names = vars.names
+        d = {}
+        if instr.dest is not None:
+            d["dest"] = names[instr.dest]
+        if instr.type is not None:
+            d["type"] = instr.type
+        d["op"] = opcodes.names[instr.op]
+        if instr.args is not None:
+            d["args"] = [names[a] for a in instr.args]
+        if instr.funcs is not None:
+            d["funcs"] = list(instr.funcs)
+        if instr.labels is not None:
+            d["labels"] = list(instr.labels)
+        if instr.value is not None:
+            d["value"] = instr.value
+    if instr.extra:
+        d.update(instr.extra)
+    return d
+
+
+def function_from_json(d: dict) -> Function:
+    vars = Interner()
+    args = None
+    if "args" in d:
+        args = [
+            (vars.intern(a["name"]), a["type"], _extra(a, {"name", "type"}))
+            for a in d["args"]
+        ]
+    instrs = [instr_from_json(i, vars) for i in d["instrs"]]
+    return Function(d["name"], args, d.get("type"), instrs, vars, _extra(d, _func_keys))
+
+
+def function_to_json(func: Function) -> dict:
+    d = {"name": func.name}
+    if func.args is not None:
+        d["args"] = []
+        for a, t, extra in func.args:
+            arg = {"name": func.vars.names[a], "type": t}
+            if extra:
+                arg.update(extra)
+            d["args"].append(arg)
+    if func.type is not None:
+        d["type"] = func.type
+    d["instrs"] = [instr_to_json(i, func.vars) for i in func.instrs]
+    if func.extra:
+        d.update(func.extra)
+    return d
+
+
+def from_json(d: dict) -> Program:
+    return Program(
+        [function_from_json(f) for f in d["functions"]],
+        _extra(d, {"functions"}),
+    )
+
+
+def to_json(prog: Program) -> dict:
+    d = {"functions": [function_to_json(f) for f in prog.functions]}
+    if prog.extra:
+        d.update(prog.extra)
+    return d
+
+
+def _wrap(x: int) -> int:
+    """wraps to a 64 bit two's complement int, like brili"""
+    x &= (1 << 64) - 1
+    return x - (1 << 64) if x >> 63 else x
+
+
+def eval_op(op: str, args: list):
+    """
+    evaluates a pure core value op on constant args. ints wrap at 64 bits and
+    div truncates toward zero, as in brili. returns None when op isn't a pure
+    core op or can't be evaluated (division by zero).
+    """
+    match op:
+        case "id":
+            return args[0]
+        case "add":
+            return _wrap(args[0] + args[1])
+        case "sub":
+            return _wrap(args[0] - args[1])
+        case "mul":
+            return _wrap(args[0] * args[1])
+        case "div":
+            a, b = args
+            if b == 0:
+                return None
+            q = abs(a) // abs(b)
+            return _wrap(q if (a < 0) == (b < 0) else -q)
+        case "eq":
+            return args[0] == args[1]
+        case "lt":
+            return args[0] < args[1]
+        case "gt":
+            return args[0] > args[1]
+        case "le":
+            return args[0] <= args[1]
+        case "ge":
+            return args[0] >= args[1]
+        case "not":
+            return not args[0]
+        case "and":
+            return args[0] and args[1]
+        case "or":
+            return args[0] or args[1]
+    return None
@@ -0,0 +1,238 @@
+"""
+On-disk cache of optimized functions, so rerunning a pipeline only redoes the
+stages whose input or code changed.
+
+An entry is keyed by the digest of the stage's input function, the pass name,
+its options and a digest of the pass's source (its module and every module in
+this directory that one imports, also from inside a function). Each entry also records the digest of its
+output, which becomes the input digest of the next stage without having to
+serialize anything. So after editing one pass, the stages before it are read
+back from disk, it reruns, and the stages after it hit again as long as its
+output didn't change.
+
+The cache is bounded in size. Reads bump an entry's mtime, and evict() drops
+the least recently used entries until the total fits.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import types
+from typing import Optional
+
+import metrics
+from blocks import BasicBlocks
+from parallel import imap, map_functions
+from stream import stream_program
+
+DEFAULT_SIZE = 256 * 1024 * 1024
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_versions = {}  # module file -> digest of its source and local imports
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def func_digest(func) -> str:
+    return _digest(json.dumps(func, separators=(",", ":")))
+
+
+def _local_file(obj) -> Optional[str]:
+    """the file in this directory obj (a module, function, ...) comes from"""
+    if isinstance(obj, types.ModuleType):
+        module = obj
+    else:
+        module = sys.modules.get(getattr(obj, "__module__", None) or "")
+    path = getattr(module, "__file__", None)
+    if path is None:
+        return None
+    path = os.path.abspath(path)
+    return path if os.path.dirname(path) == _here else None
+
+
+def _local_imports(path: str) -> list[str]:
+    """
+    the files in this directory that the module at path imports anywhere,
+    including the imports inside functions that break import cycles
+    """
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), path)
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            names.append(node.module)
+    files = (os.path.join(_here, name.split(".")[0] + ".py") for name in names)
+    return [f for f in files if os.path.isfile(f)]
+
+
+def source_version(fn) -> str:
+    """digest of the source fn was loaded from, with its local imports"""
+    root = _local_file(fn)
+    if root is None:
+        return ""
+    if root in _versions:
+        return _versions[root]
+
+    seen = {root}
+    work = [root]
+    while work:
+        for path in _local_imports(work.pop()):
+            if path not in seen:
+                seen.add(path)
+                work.append(path)
+
+    h = hashlib.sha256()
+    for path in sorted(seen):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    _versions[root] = h.hexdigest()
+    return _versions[root]
+
+
+class PassCache:
+    def __init__(self, root: str, max_size: int = DEFAULT_SIZE):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, in_digest: str, name: str, fn, options=None) -> str:
+        opts = json.dumps(options, sort_keys=True)
+        return _digest(f"{in_digest}\0{name}\0{opts}\0{source_version(fn)}")
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key[2:] + ".json")
+
+    def get(self, key):
+        """returns (output digest, function), or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry["digest"], entry["func"]
+
+    def put(self, key, func) -> str:
+        """stores func under key and returns its digest"""
+        # key order is kept, so a hit prints exactly what a miss would
+        text = json.dumps(func, separators=(",", ":"))
+        digest = _digest(text)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so concurrent workers never see half an entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            f.write(f'{{"digest":"{digest}","func":{text}}}')
+        os.replace(tmp, path)
+        return digest
+
+    def evict(self):
+        """deletes the least recently used entries until the cache fits"""
+        entries = []
+        total = 0
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def run_stages(func, stages, cache: Optional[PassCache] = None):
+    """
+    runs func through stages, a list of (name, pass, options) where a pass
+    takes a BasicBlocks and returns the one the next stage should see.
+    returns the optimized function.
+    """
+    if cache is None:
+        bb = BasicBlocks(func)
+        for name, fn, _ in stages:
+            with metrics.timer(f"pass.{name}"):
+                bb = fn(bb)
+        return bb.to_func()
+
+    digest = func_digest(func)
+    bb = None  # only built once some stage misses
+    for name, fn, options in stages:
+        key = cache.key(digest, name, fn, options)
+        hit = cache.get(key)
+        if hit is not None:
+            metrics.count("cache.hits")
+            digest, func = hit
+            bb = None
+            continue
+        metrics.count("cache.misses")
+        if bb is None:
+            bb = BasicBlocks(func)
+        with metrics.timer(f"pass.{name}"):
+            bb = fn(bb)
+        # later passes mutate instructions in place, so store a snapshot now
+        func = bb.to_func()
+        digest = cache.put(key, func)
+    return func if bb is None else bb.to_func()
+
+
+def run_program(prog, stages, jobs=1, cache: Optional[PassCache] = None):
+    """run_stages over every function of prog, on up to jobs processes"""
+    if cache is not None:
+        for _, fn, _ in stages:
+            source_version(fn)  # once here, instead of once per worker
+    map_functions(prog, lambda func: run_stages(func, stages, cache), jobs)
+    if cache is not None:
+        cache.evict()
+    return prog
+
+
+def run_stream(infile, outfile, stages, jobs=1, cache: Optional[PassCache] = None):
+    """
+    like run_program, but reads the program from infile and writes the result
+    to outfile one function at a time, see stream.py
+    """
+    if cache is not None:
+        for _, fn, _ in stages:
+            source_version(fn)
+
+    def process(funcs):
+        return imap(funcs, lambda func: run_stages(func, stages, cache), jobs)
+
+    stream_program(infile, outfile, process)
+    if cache is not None:
+        cache.evict()
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--cache-dir", help="reuse optimized functions stored here by earlier runs"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_SIZE // (1024 * 1024),
+        help="cache size limit in MiB",
+    )
+
+
+def from_args(args) -> Optional[PassCache]:
+    if not args.cache_dir:
+        return None
+    return PassCache(args.cache_dir, args.cache_size * 1024 * 1024)
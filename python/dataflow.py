@@ -1,36 +1,66 @@
 import argparse
-import json
+import heapq
+import itertools
+import operator
 import sys
 from collections import deque
+from collections.abc import Sequence
 from typing import Iterable
 
-from blocks import BasicBlocks
+import cache
+import metrics
+from blocks import BasicBlocks, _gen_reverse_postorder
+from bril import Interner
 
 uop = ["not", "id"]
 binop = ["add", "sub", "mul", "div", "and", "or", "eq", "lt", "gt", "le", "ge"]
-debug_mode = False
-
 
 class AbstractProp:
+    """
+    properties whose facts are sets of variable names can set bitvector = True
+    and implement init_bits, merge_bits and transfer_bits. dataflow() then
+    interns the function's variables and runs the analysis over ints, one bit
+    per variable, converting back to sets of names at the end.
+    """
+
+    bitvector = False
+
+    # gen/kill style bitvector properties can set this to a function from an
+    # encoded block to its (gen, kill) bits. the engine then summarizes every
+    # block once and transfer becomes gen | (prop & ~kill).
+    gen_kill = None
 
     def init():
-        raise "Init not implemented"
+        raise NotImplementedError("init")
 
     def merge(sets):
-        raise "Merge not implemented"
+        raise NotImplementedError("merge")
 
     def transfer(b, iter):
-        raise "Transfer not implemented"
+        raise NotImplementedError("transfer")
 
     def is_forward() -> bool:
-        raise "IDK"
+        raise NotImplementedError("is_forward")
 
     def to_string(prop) -> str:
         return prop
 
+    def init_bits() -> int:
+        return 0
+
+    def merge_bits(props: Iterable[int]) -> int:
+        raise NotImplementedError("merge_bits")
+
+    def transfer_bits(b: list[tuple[int, int]], prop: int) -> int:
+        """
+        b is the block encoded by _encode_block, a (dest bit, args bits) pair
+        per instruction
+        """
+        raise NotImplementedError("transfer_bits")
+
 
 class InitVar(AbstractProp):
-    """MIGHT BE BROKEN AFTER REFACTOR"""
+    bitvector = True
 
     def init():
         return set()
@@ -42,21 +72,38 @@ class InitVar(AbstractProp):
             return set()
         assert len(sets) > 0
 
-        acc: set = sets[0]
-        for i in sets:
-            acc.intersection_update(i)
-        return acc
+        return set.intersection(*sets)
 
-    def transfer(b, set1: set):
+    def transfer(b, set1: set, optimize=False):
         set2 = set1.copy()
         for instr in b:
             if "dest" in instr:
                 set2.add(instr["dest"])
-        return set2, set1 == set2, []
+        return set2, b
+
+    def is_equal(prop1, prop2):
+        return prop1 == prop2
 
     def is_forward():
         return True
 
+    def merge_bits(props):
+        acc = None
+        for prop in props:
+            acc = prop if acc is None else acc & prop
+        return 0 if acc is None else acc
+
+    def transfer_bits(b, prop):
+        for dest, _ in b:
+            prop |= dest
+        return prop
+
+    def gen_kill(b):
+        gen = 0
+        for dest, _ in b:
+            gen |= dest
+        return gen, 0
+
     def to_string(prop):
         if not prop:
             return "[]"
@@ -110,7 +157,7 @@ class ConstProp(AbstractProp):
                 elif op == "id":
                     out_prop[dest] = a
                 else:
-                    raise "????"
+                    raise NotImplementedError(op)
 
                 if optimize:
                     new_b[-1]["op"] = "const"
@@ -143,7 +190,7 @@ class ConstProp(AbstractProp):
                 elif op == "lt":
                     out_prop[dest] = a < b
                 else:
-                    raise "not implemented"
+                    raise NotImplementedError(op)
 
                 if optimize:
                     new_b[-1]["op"] = "const"
@@ -182,6 +229,7 @@ class Interval(AbstractProp):
 
 
 class Reaching(AbstractProp):
+    bitvector = True
 
     def init():
         return set()
@@ -206,8 +254,26 @@ class Reaching(AbstractProp):
     def is_forward():
         return True
 
+    def merge_bits(props):
+        out = 0
+        for prop in props:
+            out |= prop
+        return out
+
+    def transfer_bits(b, prop):
+        for dest, _ in b:
+            prop |= dest
+        return prop
+
+    def gen_kill(b):
+        gen = 0
+        for dest, _ in b:
+            gen |= dest
+        return gen, 0
+
 
 class Liveness(AbstractProp):
+    bitvector = True
 
     def init() -> set:
         return set()
@@ -221,6 +287,10 @@ class Liveness(AbstractProp):
         return out
 
     def transfer(b: list, prop: set, optimize=False):
+        """
+        with optimize, assignments to dead variables are dropped, and their
+        arguments don't count as uses
+        """
         if optimize:
             keep = [True] * len(b)
 
@@ -233,9 +303,8 @@ class Liveness(AbstractProp):
                 dest = instr["dest"]
                 if dest in in_prop:
                     in_prop.remove(dest)
-                else:
-                    if optimize:
-                        keep[i] = False
+                elif optimize:
+                    keep[i] = False
                     continue
 
             if "args" in instr:
@@ -261,6 +330,70 @@ class Liveness(AbstractProp):
             return "{}"
         return str(p)
 
+    def merge_bits(props):
+        out = 0
+        for prop in props:
+            out |= prop
+        return out
+
+    def transfer_bits(b, prop):
+        for dest, args in reversed(b):
+            prop = (prop & ~dest) | args
+        return prop
+
+    def gen_kill(b):
+        """gen is the upward exposed uses, kill the definitions"""
+        gen = kill = 0
+        for dest, args in reversed(b):
+            gen = (gen & ~dest) | args
+            kill |= dest
+        return gen, kill
+
+
+class Faint(Liveness):
+    """
+    faint variables: liveness, except that an assignment to a dead variable
+    doesn't make its arguments live. a chain of dead assignments dies together,
+    across blocks too. that isn't gen/kill, so every visit walks the block.
+    """
+
+    gen_kill = None
+
+    def transfer(b: list, prop: set, optimize=False):
+        if optimize:
+            keep = [True] * len(b)
+
+        in_prop = prop.copy()
+        for i in range(len(b) - 1, -1, -1):
+
+            instr = b[i]
+
+            if "dest" in instr:
+                dest = instr["dest"]
+                if dest in in_prop:
+                    in_prop.remove(dest)
+                else:
+                    if optimize:
+                        keep[i] = False
+                    continue
+
+            in_prop.update(instr.get("args", ()))
+
+        if optimize:
+            new_b = [b[i] for i in range(len(b)) if keep[i]]
+        else:
+            new_b = []
+        return in_prop, new_b
+
+    def transfer_bits(b, prop):
+        for dest, args in reversed(b):
+            if dest:
+                if not prop & dest:
+                    continue
+                prop &= ~dest
+            prop |= args
+        return prop
+
 
 def df_interval(blocks):
     blocks, pred, succ = blocks.blocks, blocks.pred, blocks.succ
@@ -277,27 +410,147 @@ def df_interval(blocks):
         in_prop = Interval.merge(prop)
 
 
-def dataflow(blocks: BasicBlocks, property: AbstractProp, optimize=False):
+def _var_index(blocks: BasicBlocks) -> Interner:
+    index = Interner(blocks.fun_args)
+    for b in blocks.blocks:
+        for instr in b:
+            if "dest" in instr:
+                index.intern(instr["dest"])
+            for arg in instr.get("args", ()):
+                index.intern(arg)
+    return index
+
+
+def _encode_block(b: list[dict], index: Interner) -> list[tuple[int, int]]:
+    ids = index.ids
+    encoded = []
+    for instr in b:
+        dest = 1 << ids[instr["dest"]] if "dest" in instr else 0
+        args = 0
+        for arg in instr.get("args", ()):
+            args |= 1 << ids[arg]
+        encoded.append((dest, args))
+    return encoded
+
+
+_digit_to_byte = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def _bits_to_set(bits: int, index: Interner) -> set:
+    # peeling off the lowest bit would copy the whole int every time. instead
+    # turn the binary digits (least significant first) into 0/1 selectors
+    selectors = bin(bits)[:1:-1].encode().translate(_digit_to_byte)
+    return set(itertools.compress(index.names, selectors))
+
+
+class _BitFacts(Sequence):
+    """
+    the per block facts of a bitvector run. they stay ints until a block's
+    fact is actually looked at, and then turn into a set of names.
+    """
+
+    def __init__(self, bits: list[int], index: Interner):
+        self.bits = bits
+        self._index = index
+        self._sets = [None] * len(bits)
+
+    def __len__(self):
+        return len(self.bits)
+
+    def __getitem__(self, i):
+        if self._sets[i] is None:
+            self._sets[i] = _bits_to_set(self.bits[i], self._index)
+        return self._sets[i]
+
+    def holds(self, i, name):
+        """whether name is in block i's fact, without building the set"""
+        k = self._index.get(name)
+        return k is not None and self.bits[i] >> k & 1 == 1
+
+
+def dataflow(
+    blocks: BasicBlocks, property: AbstractProp, optimize=False, stats=None
+):
+    """
+    runs property to a fixpoint over the cfg. blocks are taken off the
+    worklist in reverse postorder for forward properties and in postorder for
+    backward ones, and a block is never queued twice.
+
+    if stats is a dict, it gets the number of block visits and transfer calls
+    of this run. the same go to the dataflow.* metrics.
+    """
+    with metrics.timer(f"dataflow.{property.__name__}"):
+        return _dataflow(blocks, property, optimize, stats)
+
+
+def _dataflow(blocks, property, optimize, stats):
     l = len(blocks.blocks)
+
+    if property.bitvector:
+        index = _var_index(blocks)
+        encoded = [_encode_block(b, index) for b in blocks.blocks]
+        init, merge, is_equal = property.init_bits, property.merge_bits, operator.eq
+
+        if property.gen_kill is not None:
+            summaries = [property.gen_kill(b) for b in encoded]
+
+            def transfer(i, prop):
+                gen, kill = summaries[i]
+                return gen | (prop & ~kill)
+
+        else:
+
+            def transfer(i, prop):
+                return property.transfer_bits(encoded[i], prop)
+
+    else:
+        init, merge, is_equal = property.init, property.merge, property.is_equal
+
+        def transfer(i, prop):
+            return property.transfer(blocks.blocks[i], prop)[0]
+
     in_prop = [None] * l
-    in_prop[0] = property.init()
-    out_prop = [property.init() for _ in range(l)]
+    if l:
+        in_prop[0] = init()
+    out_prop = [init() for _ in range(l)]
     pred, succ = blocks.pred, blocks.succ
 
+    # a plain dfs, blocks.rpo would compute the dominators along with it
+    order = _gen_reverse_postorder(succ)
     if not property.is_forward():
         pred, succ = succ, pred
-
-    worklist = deque([i for i in range(l - 1, -1, -1)])
+        order.reverse()
+
+    # blocks unreachable from the entry aren't in the rpo, they go last
+    priority = [None] * l
+    for k, i in enumerate(order):
+        priority[i] = k
+    for i in range(l):
+        if priority[i] is None:
+            priority[i] = len(order)
+            order.append(i)
+
+    worklist = list(range(l))  # priorities, sorted is already a heap
+    queued = [True] * l
+    visits = 0
     while worklist:
-        i = worklist.popleft()
-        in_prop[i] = property.merge(out_prop[j] for j in pred[i])
-        new_out_prop, new_b = property.transfer(
-            blocks.blocks[i], in_prop[i], optimize=optimize
-        )
-
-        if not property.is_equal(out_prop[i], new_out_prop):
-            worklist += succ[i]
+        i = order[heapq.heappop(worklist)]
+        queued[i] = False
+        visits += 1
+
+        in_prop[i] = merge(out_prop[j] for j in pred[i])
+        new_out_prop = transfer(i, in_prop[i])
+
+        if not is_equal(out_prop[i], new_out_prop):
             out_prop[i] = new_out_prop
+            for j in succ[i]:
+                if not queued[j]:
+                    queued[j] = True
+                    heapq.heappush(worklist, priority[j])
+
+    if property.bitvector:
+        in_prop = _BitFacts(in_prop, index)
+        out_prop = _BitFacts(out_prop, index)
 
     if optimize:
         for i in range(l):
@@ -309,54 +562,40 @@ def dataflow(blocks: BasicBlocks, property: AbstractProp, optimize=False):
     if not property.is_forward():
         in_prop, out_prop = out_prop, in_prop
 
-    if debug_mode:
-        for i in range(len(blocks.blocks)):
-            b = blocks.blocks[i]
-            if not b:
-                continue
-            # if "label" in b[0]:
-            #     print(f"  .{b[0]["label"]}:")
-
-            # print(f"    in:  {property.to_string(in_prop[i])}")
-            # print(f"    out: {property.to_string(out_prop[i])}")
+    transfers = visits + (l if optimize else 0)
+    if stats is not None:
+        stats["visits"] = visits
+        stats["transfers"] = transfers
+    metrics.count("dataflow.runs")
+    metrics.count("dataflow.visits", visits)
+    metrics.count("dataflow.transfers", transfers)
 
     return in_prop, out_prop
 
 
 def dataflow_dce(bb):
+    before = sum(map(len, bb.blocks))
+    live_blocks = [i for i, b in enumerate(bb.blocks) if b]
     dataflow(bb, ConstProp, optimize=True)
-    dataflow(bb, Liveness, optimize=True)
+    dataflow(bb, Faint, optimize=True)
+    for i in live_blocks:
+        if not bb.blocks[i]:
+            # an empty block would be a deleted one, keep it as a label
+            bb.label_of(i)
+    metrics.count("dataflow_dce.removed", before - sum(map(len, bb.blocks)))
+    return bb
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--debug", action="store_true")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
     args = parser.parse_args()
-    debug_mode = args.debug
-
-    prog = json.load(sys.stdin)
-
-    optimize = True
-
-    for i, func in enumerate(prog["functions"]):
-        blocks = BasicBlocks(func)
-        # if debug_mode:
-        #     print(f"func {func["name"]}:")
-        # for j in blocks.blocks:
-        #     print(j)
-        # print()
-        # blocks.empty_inaccessible()
-        dataflow(blocks, ConstProp, optimize=True)
-        dataflow(blocks, Liveness, optimize=True)
-
-        # print(blocks.debug_print())
-        if debug_mode:
-            print("pred:", blocks.pred)
-            print("succ:", blocks.succ)
-            print()
-
-        if optimize:
-            prog["functions"][i] = blocks.to_func()
+    metrics.from_args(args)
 
-    if not debug_mode:
-        print(json.dumps(prog))
+    stages = [("dataflow_dce", dataflow_dce, None)]
+    cache.run_stream(sys.stdin, sys.stdout, stages, args.jobs, cache.from_args(args))
+    metrics.emit()
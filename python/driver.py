@@ -0,0 +1,110 @@
+"""
+Runs a sequence of passes over a program in a single process.
+
+    bril2json < prog.bril | python3 driver.py lvn,dataflow_dce,licm,tdce
+
+The program is parsed once, each function is turned into a BasicBlocks once,
+and that same BasicBlocks is handed from one pass to the next. A pass takes a
+BasicBlocks and returns the BasicBlocks the next pass should see, normally the
+same object mutated in place. Passes that change the shape of the cfg do it
+through BasicBlocks' edit methods, which keep it valid for the next pass.
+
+Functions are optimized independently, so --jobs N spreads them over N
+processes. With --cache-dir, each stage's result is kept on disk and reused
+by later runs, see cache.py. --run ARGS... runs the result with interp.py
+right away, printing its output and total_dyn_inst like brili -p. --stats
+prints where the time went as json on stderr, see metrics.py.
+
+sccp and gvn expect SSA input, so they go between to_ssa and from_ssa:
+
+    python3 driver.py to_ssa,sccp,gvn,from_ssa,tdce
+"""
+
+import argparse
+import json
+import sys
+
+import cache
+import metrics
+from blocks import from_ssa, to_ssa
+from dataflow import dataflow_dce
+from gvn import gvn
+from interp import BrilError, run
+from loops import licm_pass
+from lvn import lvn_pass
+from sccp import sccp
+from trivial_dce import tdce
+
+
+PASSES = {
+    "lvn": lvn_pass,
+    "dataflow_dce": dataflow_dce,
+    "tdce": tdce,
+    "licm": licm_pass,
+    "to_ssa": to_ssa,
+    "from_ssa": from_ssa,
+    "sccp": sccp,
+    "gvn": gvn,
+}
+
+
+def parse_passes(spec: str) -> list[str]:
+    passes = [p.strip() for p in spec.split(",") if p.strip()]
+    for p in passes:
+        if p not in PASSES:
+            raise ValueError(f"unknown pass {p!r}, expected one of {sorted(PASSES)}")
+    return passes
+
+
+def _stages(passes):
+    return [(p, PASSES[p], None) for p in passes]
+
+
+def run_passes(func, passes, pass_cache=None):
+    return cache.run_stages(func, _stages(passes), pass_cache)
+
+
+def optimize(prog, passes, jobs=1, pass_cache=None):
+    return cache.run_program(prog, _stages(passes), jobs, pass_cache)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "passes", help="comma separated list of passes, e.g. lvn,dataflow_dce,tdce"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    parser.add_argument(
+        "--run",
+        nargs="*",
+        metavar="ARG",
+        help="run the optimized program with these args instead of printing it",
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.from_args(args)
+
+    try:
+        passes = parse_passes(args.passes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.run is None:
+        cache.run_stream(
+            sys.stdin, sys.stdout, _stages(passes), args.jobs, cache.from_args(args)
+        )
+        metrics.emit()
+        sys.exit()
+
+    prog = optimize(json.load(sys.stdin), passes, args.jobs, cache.from_args(args))
+    try:
+        with metrics.timer("interp"):
+            interp = run(prog, args.run)
+    except BrilError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(2)
+    print(f"total_dyn_inst: {interp.dyn_inst}", file=sys.stderr)
+    metrics.emit()
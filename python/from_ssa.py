@@ -1,15 +1,21 @@
-from blocks import BasicBlocks
+import argparse
+import sys
 
+import cache
+import metrics
+from blocks import from_ssa
 
-if __name__ == "__main__":
-    import json, sys
-
-    prog = json.load(sys.stdin)
 
-    for i, func in enumerate(prog["functions"]):
-        bb = BasicBlocks(func)
-        bb.from_ssa()
-
-        prog["functions"][i] = bb.to_func()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.from_args(args)
 
-    print(json.dumps(prog))
+    stages = [("from_ssa", from_ssa, None)]
+    cache.run_stream(sys.stdin, sys.stdout, stages, args.jobs, cache.from_args(args))
+    metrics.emit()
@@ -0,0 +1,163 @@
+"""
+Global value numbering over the SSA form made by BasicBlocks.to_ssa().
+
+Walks the dominator tree with one hash table of values, keyed like lvn's.
+Entries made in a block stay visible in the blocks it dominates and are
+dropped on the way back up, so a value computed in a loop header is reused in
+the body, but two sibling branches never share. In SSA a name is only
+assigned once, so the ssa names themselves serve as value numbers.
+
+    bril2json < prog.bril | python3 gvn.py | python3 trivial_dce.py | brili -p
+"""
+
+import argparse
+import sys
+from collections import defaultdict
+
+import cache
+import metrics
+from blocks import from_ssa, to_ssa
+from bril import eval_op
+from lvn import default_opts, fold_ops, no_cse_ops, value_key
+
+
+def gvn(bb, active_opts=None):
+    """
+    replaces instructions that recompute a value already available in a
+    dominating block with a copy of it. takes the same options as lvn. bb
+    has to be in SSA form, and is changed in place.
+    """
+    if active_opts is None:
+        active_opts = default_opts
+    if not bb.n:
+        return bb
+
+    ndefs = defaultdict(int)
+    for b in bb.blocks:
+        for instr in b:
+            if "dest" in instr:
+                ndefs[instr["dest"]] += 1
+
+    # names assigned more than once (the input wasn't quite SSA) are left
+    # alone entirely. a get's name has its one def too: from_ssa coalesces
+    # the copies out of its sets around whatever else is live, so it can be
+    # an operand or a leader like any other name. function args have no def
+    # at all.
+    def stable(var):
+        return ndefs[var] <= 1
+
+    leader = {}  # name -> the name its uses read instead
+    consts = {}  # name -> its constant value
+    table = {}  # value key -> name holding it, for the blocks on the stack
+
+    replaced = folded = 0
+
+    def visit(b):
+        nonlocal replaced, folded
+        added = []
+        block = bb.blocks[b]
+        for k, instr in enumerate(block):
+            if "op" not in instr:
+                continue
+            op = instr["op"]
+
+            args = instr.get("args")
+            if args:
+                instr = dict(instr)
+                if op == "set":  # args[0] names the get, not a value
+                    args = [args[0], leader.get(args[1], args[1])]
+                else:
+                    args = [leader.get(a, a) for a in args]
+                instr["args"] = args
+                block[k] = instr
+
+            dest = instr.get("dest")
+            if dest is None or op in no_cse_ops or not stable(dest):
+                continue
+            if not all(stable(a) for a in args or ()):
+                continue
+
+            value = instr.get("value")
+            if op == "id" and args[0] in consts and "const_prop" in active_opts:
+                value = consts[args[0]]
+                block[k] = _const(instr, value)
+                op, args = "const", ()
+            elif op == "id" and "copy_prop" in active_opts:
+                leader[dest] = args[0]
+                if args[0] in consts:
+                    consts[dest] = consts[args[0]]
+                continue
+            elif (
+                "const_fold" in active_opts
+                and op in fold_ops
+                and all(a in consts for a in args)
+            ):
+                const = eval_op(op, [consts[a] for a in args])
+                if const is not None:
+                    block[k] = _const(instr, const)
+                    op, args, value = "const", (), const
+                    folded += 1
+            if op == "const":
+                consts[dest] = value
+
+            if op == "const" and "const_fold" in active_opts:
+                continue  # a const is as cheap as an id, and folds further
+
+            key = value_key(op, args or (), value, active_opts)
+            if key in table:
+                leader[dest] = table[key]
+                if op != "const":
+                    instr = dict(instr)
+                    instr["op"] = "id"
+                    instr["args"] = [table[key]]
+                    instr.pop("value", None)
+                    block[k] = instr
+                    replaced += 1
+            else:
+                table[key] = dest
+                added.append(key)
+        return added
+
+    # preorder walk of the dominator tree, undoing each block's entries once
+    # its subtree is done
+    stack = [(bb.dom_tree, None)]
+    while stack:
+        node, added = stack.pop()
+        if added is not None:
+            for key in added:
+                del table[key]
+            continue
+        b, children = node
+        stack.append((node, visit(b)))
+        stack.extend((child, None) for child in reversed(children))
+    metrics.count("gvn.replaced", replaced)
+    metrics.count("gvn.folded", folded)
+    return bb
+
+
+def _const(instr, value):
+    return {
+        "dest": instr["dest"],
+        "type": instr.get("type", "bool" if isinstance(value, bool) else "int"),
+        "op": "const",
+        "value": value,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.from_args(args)
+
+    stages = [
+        ("to_ssa", to_ssa, None),
+        ("gvn", gvn, None),
+        ("from_ssa", from_ssa, None),
+    ]
+    cache.run_stream(sys.stdin, sys.stdout, stages, args.jobs, cache.from_args(args))
+    metrics.emit()
@@ -0,0 +1,368 @@
+"""
+A Bril interpreter on the bril.py representation, so a pipeline can optimize
+and run a program in one process instead of handing json to brili.
+
+    bril2json < prog.bril | python3 interp.py -p 5 true
+
+Follows brili: core, SSA (get/set/undef), memory and float instructions, ints
+wrap at 64 bits, -p prints total_dyn_inst to stderr. --profile FILE also
+counts how often every block and instruction ran and writes that as json:
+
+    {"main": {"calls": 1, "blocks": {"loop": 10, ...}, "instrs": [1, 1, 0, ...]}}
+
+where instrs lines up with the function's json instrs (labels are 0) and the
+entry block is counted by calls.
+"""
+
+import argparse
+import json
+import math
+import sys
+
+import bril
+from bril import (
+    ADD,
+    AND,
+    BR,
+    CALL,
+    CONST,
+    DIV,
+    EQ,
+    GE,
+    GET,
+    GT,
+    ID,
+    JMP,
+    LABEL,
+    LE,
+    LT,
+    MUL,
+    NOP,
+    NOT,
+    OR,
+    PRINT,
+    RET,
+    SET,
+    SUB,
+    UNDEF,
+)
+
+_undef = object()  # value of a variable that was never assigned
+
+
+class BrilError(Exception):
+    pass
+
+
+class StepLimit(BrilError):
+    pass
+
+
+class _Pointer:
+    __slots__ = ("base", "offset")
+
+    def __init__(self, base, offset):
+        self.base = base
+        self.offset = offset
+
+
+def _div(a, b):
+    if b == 0:
+        raise BrilError("division by zero")
+    q = abs(a) // abs(b)
+    return bril._wrap(q if (a < 0) == (b < 0) else -q)
+
+
+def _format(v) -> str:
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    if isinstance(v, float):
+        if math.isnan(v):
+            return "NaN"
+        if math.isinf(v):
+            return "Infinity" if v > 0 else "-Infinity"
+        return f"{v:.17f}"
+    return str(v)
+
+
+def _fdiv(a, b):
+    # javascript division, which never raises
+    if b:
+        return a / b
+    if a == 0 or math.isnan(a):
+        return math.nan
+    return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+# the pure ops that aren't hardwired in Interpreter._call
+_other_ops = {
+    "fadd": lambda a, b: a + b,
+    "fsub": lambda a, b: a - b,
+    "fmul": lambda a, b: a * b,
+    "fdiv": _fdiv,
+    "feq": lambda a, b: a == b,
+    "flt": lambda a, b: a < b,
+    "fgt": lambda a, b: a > b,
+    "fle": lambda a, b: a <= b,
+    "fge": lambda a, b: a >= b,
+    "ceq": lambda a, b: a == b,
+    "clt": lambda a, b: a < b,
+    "cgt": lambda a, b: a > b,
+    "cle": lambda a, b: a <= b,
+    "cge": lambda a, b: a >= b,
+    "char2int": ord,
+    "int2char": chr,
+}
+
+
+class _Function:
+    """a bril.Function plus what the interpreter needs precomputed"""
+
+    def __init__(self, func: bril.Function):
+        self.func = func
+        self.nvars = len(func.vars)
+        self.labels = {}
+        for i, instr in enumerate(func.instrs):
+            if instr.op == LABEL:
+                self.labels[instr.label] = i
+        self.targets = [
+            tuple(self.labels[l] for l in instr.labels)
+            if instr.op in (JMP, BR)
+            else None
+            for instr in func.instrs
+        ]
+
+
+class Interpreter:
+    def __init__(self, prog: bril.Program, out=sys.stdout, profile=False, limit=None):
+        self.funcs = {f.name: _Function(f) for f in prog.functions}
+        self.out = out
+        self.dyn_inst = 0
+        self.limit = limit  # most instructions to run before giving up
+        self.heap = {}  # base -> list of cells
+        self.next_base = 0
+        # name -> {"calls": n, "blocks": {label: n}, "instrs": [n, ...]}
+        self.profile = {} if profile else None
+
+    def run(self, args: list[str]):
+        main = self.funcs.get("main")
+        if main is None:
+            raise BrilError("no main function")
+        params = main.func.args or []
+        if len(args) != len(params):
+            raise BrilError(f"main expects {len(params)} args, got {len(args)}")
+        values = [_parse_arg(a, t) for a, (_, t, _) in zip(args, params)]
+        self._call(main, values)
+        if self.heap:
+            raise BrilError(f"{len(self.heap)} allocation(s) never freed")
+
+    def _enter(self, f: _Function, values):
+        """a new frame for a call of f, see _call"""
+        func = f.func
+        env = [_undef] * f.nvars
+        for (a, _, _), v in zip(func.args or (), values):
+            env[a] = v
+        counts = labels_seen = None
+        if self.profile is not None:
+            prof = self.profile.get(func.name)
+            if prof is None:
+                prof = self.profile[func.name] = {
+                    "calls": 0,
+                    "blocks": {},
+                    "instrs": [0] * len(func.instrs),
+                }
+            prof["calls"] += 1
+            counts = prof["instrs"]
+            labels_seen = prof["blocks"]
+        # the pc to resume at and the caller's dest for the result are
+        # filled in when the frame makes a call
+        return [f, env, {}, counts, labels_seen, 0, None]
+
+    def _call(self, f: _Function, values):
+        """
+        runs f to completion. calls don't recurse in python: the caller's
+        frame is saved on a stack, so bril programs can recurse as deep as
+        memory allows.
+        """
+        stack = []
+        frame = self._enter(f, values)
+        limit = self.limit or math.inf
+        while True:
+            f, env, shadow, counts, labels_seen, pc, _ = frame
+            func = f.func
+            instrs = func.instrs
+            targets = f.targets
+
+            def arg(i):
+                v = env[i]
+                if v is _undef:
+                    raise BrilError(f"undefined variable {func.vars.name(i)}")
+                return v
+
+            result = None
+            n = len(instrs)
+            call = None
+            while pc < n:
+                instr = instrs[pc]
+                op = instr.op
+                if op == LABEL:
+                    if labels_seen is not None:
+                        labels_seen[instr.label] = labels_seen.get(instr.label, 0) + 1
+                    pc += 1
+                    continue
+                self.dyn_inst += 1
+                if self.dyn_inst > limit:
+                    raise StepLimit(f"ran more than {self.limit} instructions")
+                if counts is not None:
+                    counts[pc] += 1
+                args = instr.args
+                dest = instr.dest
+                pc += 1
+
+                if op == CONST:
+                    value = instr.value
+                    if instr.type == "float":
+                        value = float(value)
+                    env[dest] = value
+                elif op == ID:
+                    env[dest] = env[args[0]]  # copying undef is fine, using it isn't
+                elif op == ADD:
+                    env[dest] = bril._wrap(arg(args[0]) + arg(args[1]))
+                elif op == SUB:
+                    env[dest] = bril._wrap(arg(args[0]) - arg(args[1]))
+                elif op == MUL:
+                    env[dest] = bril._wrap(arg(args[0]) * arg(args[1]))
+                elif op == DIV:
+                    env[dest] = _div(arg(args[0]), arg(args[1]))
+                elif op == EQ:
+                    env[dest] = arg(args[0]) == arg(args[1])
+                elif op == LT:
+                    env[dest] = arg(args[0]) < arg(args[1])
+                elif op == GT:
+                    env[dest] = arg(args[0]) > arg(args[1])
+                elif op == LE:
+                    env[dest] = arg(args[0]) <= arg(args[1])
+                elif op == GE:
+                    env[dest] = arg(args[0]) >= arg(args[1])
+                elif op == NOT:
+                    env[dest] = not arg(args[0])
+                elif op == AND:
+                    env[dest] = arg(args[0]) and arg(args[1])
+                elif op == OR:
+                    env[dest] = arg(args[0]) or arg(args[1])
+                elif op == JMP:
+                    pc = targets[pc - 1][0]
+                elif op == BR:
+                    pc = targets[pc - 1][0 if arg(args[0]) else 1]
+                elif op == PRINT:
+                    print(" ".join(_format(arg(a)) for a in args or ()), file=self.out)
+                elif op == CALL:
+                    callee = self.funcs.get(instr.funcs[0])
+                    if callee is None:
+                        raise BrilError(f"unknown function {instr.funcs[0]}")
+                    call = (callee, [arg(a) for a in args or ()], dest)
+                    break
+                elif op == RET:
+                    result = arg(args[0]) if args else None
+                    break
+                elif op == GET:
+                    env[dest] = shadow.get(dest, _undef)
+                elif op == SET:
+                    shadow[args[0]] = env[args[1]]
+                elif op == UNDEF:
+                    env[dest] = _undef
+                elif op == NOP:
+                    pass
+                else:
+                    self._other(instr, env, arg)
+
+            if call is not None:
+                callee, values, dest = call
+                frame[5], frame[6] = pc, dest
+                stack.append(frame)
+                frame = self._enter(callee, values)
+                continue
+            if not stack:
+                return result
+            frame = stack.pop()
+            if frame[6] is not None:
+                frame[1][frame[6]] = result
+
+    def _other(self, instr, env, arg):
+        """memory and the rarer value ops"""
+        name = bril.opcodes.name(instr.op)
+        args = instr.args or ()
+        if name == "alloc":
+            size = arg(args[0])
+            if size <= 0:
+                raise BrilError(f"cannot allocate {size} cells")
+            self.heap[self.next_base] = [_undef] * size
+            env[instr.dest] = _Pointer(self.next_base, 0)
+            self.next_base += 1
+        elif name == "free":
+            p = arg(args[0])
+            if p.offset != 0 or p.base not in self.heap:
+                raise BrilError("free of a pointer that wasn't allocated")
+            del self.heap[p.base]
+        elif name == "ptradd":
+            p = arg(args[0])
+            env[instr.dest] = _Pointer(p.base, p.offset + arg(args[1]))
+        elif name in ("load", "store"):
+            p = arg(args[0])
+            cells = self.heap.get(p.base)
+            if cells is None or not 0 <= p.offset < len(cells):
+                raise BrilError(f"{name} out of bounds")
+            if name == "store":
+                cells[p.offset] = arg(args[1])
+            else:
+                if cells[p.offset] is _undef:
+                    raise BrilError("load of an uninitialized cell")
+                env[instr.dest] = cells[p.offset]
+        elif name in _other_ops:
+            env[instr.dest] = _other_ops[name](*(arg(a) for a in args))
+        else:
+            raise BrilError(f"unknown op {name}")
+
+
+def _parse_arg(s: str, t):
+    if t == "bool":
+        if s not in ("true", "false"):
+            raise BrilError(f"bad bool argument {s}")
+        return s == "true"
+    if t == "float":
+        return float(s)
+    return int(s)
+
+
+def run(prog, args, out=sys.stdout, profile=False, limit=None) -> Interpreter:
+    """
+    runs a program, given as json or a bril.Program, and returns the finished
+    Interpreter, whose dyn_inst and profile are the results
+    """
+    if isinstance(prog, dict):
+        prog = bril.from_json(prog)
+    interp = Interpreter(prog, out, profile, limit)
+    interp.run(args)
+    return interp
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-p", action="store_true", help="print total_dyn_inst to stderr"
+    )
+    parser.add_argument("--profile", metavar="FILE", help="write block counts here")
+    parser.add_argument("args", nargs="*", help="arguments to main")
+    args = parser.parse_args()
+
+    try:
+        interp = run(json.load(sys.stdin), args.args, profile=bool(args.profile))
+    except BrilError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.p:
+        print(f"total_dyn_inst: {interp.dyn_inst}", file=sys.stderr)
+    if args.profile:
+        with open(args.profile, "w") as f:
+            json.dump(interp.profile, f)
@@ -1,140 +1,350 @@
-from blocks import BasicBlocks
-from dataflow import dataflow, Reaching, dataflow_dce
+import argparse
+import sys
+from collections import defaultdict
 
+import cache
+import metrics
+from dataflow import Liveness, dataflow
 
-def find_natural_loops(bb):
-    natural_loops = {}
 
-    for b in range(bb.n):
-        for a in bb.pred[b]:  # a -> b
-            if b in bb.dom[a]:  # b dominates a
-                natural_loops[(a, b)] = set()
+class Loop:
+    """
+    a natural loop, with the bodies of all back edges to its header merged.
+    body holds the blocks of the nested loops too. exits are the edges (a, s)
+    leaving the body. preheader is the header's one reachable outside
+    predecessor if that jumps nowhere else, or None until a pass inserts one.
+    """
 
-    for a, b in natural_loops:
-        q = [a, b]
-        while q:
-            n = q.pop()
-            if n in natural_loops[(a, b)]:
-                continue
-            natural_loops[(a, b)].add(n)
-            if n == b:
-                continue
-            for c in bb.pred[n]:
-                q.append(c)
+    def __init__(self, header):
+        self.header = header
+        self.latches = []
+        self.body = {header}
+        self.parent = None
+        self.children = []
+        self.depth = 1
+        self.exits = []
+        self.preheader = None
 
-    return natural_loops
+    def __repr__(self):
+        body = sorted(self.body)
+        return f"Loop(header={self.header}, depth={self.depth}, body={body})"
 
 
-def try_fresh(labels, attempt=None):
-    # labels = set()
-    # for b in bb.blocks:
-    #     if len(b) == 0:
-    #         continue
-    #     if "label" not in b[0]:
-    #         continue
-    #     labels.add(b[0]["label"])
+class LoopForest:
+    """
+    the loops of a cfg and how they nest, built once from its dominators.
+    bb.loop_forest caches it until the next cfg edit.
 
-    if attempt is None or attempt in labels:
-        for i in range(len(labels) + 1):
-            if str(i) not in labels:
-                return str(i)
-    else:
-        return attempt
+    self.loops are the loops innermost first, so children come before their
+    parents. self.roots are the outermost ones. self.by_header[b] is the loop
+    headed by b, self.innermost[b] the innermost loop containing block b, or
+    None outside of loops.
+    """
 
+    def __init__(self, bb):
+        with metrics.timer("loop_forest"):
+            self._build(bb)
 
-def licm(bb, loop, in_reach, out_reach, a, b, labels):
-    changing = True
-    loop_inv = {a: set() for a in loop}
-    loop_vars = set()
-    for a in loop:
-        for instr in bb.blocks[a]:
-            if "dest" in instr:
-                loop_vars.add(instr["dest"])
+    def _build(self, bb):
+        self.by_header = {}
+        for b in bb.rpo:
+            for a in bb.pred[b]:
+                if a == b or bb._is_strictly_dom(b, a):  # a back edge
+                    if b not in self.by_header:
+                        self.by_header[b] = Loop(b)
+                    self.by_header[b].latches.append(a)
 
-    while changing:
-        changing = False
-        for a in loop:
-            for instr in bb.blocks[a]:
-                if "dest" not in instr:
-                    continue
-                if instr.get("op", None) in ["call"]:
-                    continue
-                dest = instr["dest"]
-                for arg in instr.get("args", []):
-                    if arg in loop_vars and arg not in loop_inv[a]:
-                        break
-                else:
-                    if dest not in loop_inv[a]:
-                        changing = True
-                        print(f"marking {dest} something as LI!", file=sys.stderr)
-                        loop_inv[a].add(dest)
-
-    assert "label" in bb.blocks[b][0]
-
-    old_header = bb.blocks[b][0]["label"]
-    preheader = [{"label": old_header}]
-
-    new_header = try_fresh(labels, old_header + ".header")
-    bb.blocks[b][0]["label"] = new_header
-    labels.add(new_header)
-
-    print("loop:", loop, file=sys.stderr)
-    for a in loop:
-        new_instrs = []
-        for instr in bb.blocks[a]:
-            if instr.get("dest", None) in loop_inv[a]:
-                preheader.append(instr)
-                print("preheader:", instr, file=sys.stderr)
+        for loop in self.by_header.values():
+            q = [a for a in loop.latches if a != loop.header]
+            loop.body.update(q)
+            while q:
+                for c in bb.pred[q.pop()]:
+                    # unreachable blocks can't be on a path from the header
+                    if c not in loop.body and bb._reachable(c):
+                        loop.body.add(c)
+                        q.append(c)
+            loop.exits = [
+                (a, s) for a in loop.body for s in bb.succ[a] if s not in loop.body
+            ]
+            outside = [
+                p
+                for p in bb.pred[loop.header]
+                if p not in loop.body and bb._reachable(p)
+            ]
+            if len(outside) == 1 and bb.succ[outside[0]] == {loop.header}:
+                loop.preheader = outside[0]
+
+        # natural loops with different headers are nested or disjoint, so
+        # going from the biggest down, a loop's parent is the innermost one
+        # seen so far that holds its header
+        self.innermost = [None] * bb.n
+        self.roots = []
+        outermost_first = sorted(
+            self.by_header.values(), key=lambda loop: -len(loop.body)
+        )
+        for loop in outermost_first:
+            parent = self.innermost[loop.header]
+            if parent is None:
+                self.roots.append(loop)
             else:
-                new_instrs.append(instr)
-                if instr.get("op", None) in ["jmp", "br"]:
-                    print("labels:", instr.get("labels", []), file=sys.stderr)
-                    for i in range(len(instr.get("labels", []))):
-                        if instr["labels"][i] == old_header:
-                            instr["labels"][i] = new_header
-        bb.blocks[a] = new_instrs
+                loop.parent = parent
+                loop.depth = parent.depth + 1
+                parent.children.append(loop)
+            for a in loop.body:
+                self.innermost[a] = loop
+        self.loops = outermost_first[::-1]
 
-    bb.blocks[b] = preheader + bb.blocks[b]
+    def depth(self, b):
+        """how many loops block b is in"""
+        loop = self.innermost[b]
+        return 0 if loop is None else loop.depth
 
+    def __iter__(self):
+        return iter(self.loops)
+
+    def __len__(self):
+        return len(self.loops)
 
-if __name__ == "__main__":
-    import sys, json
 
-    prog = json.load(sys.stdin)
+# ops that only compute a value from their args, so running them once before
+# the loop is the same as running them on every iteration
+_pure_ops = {
+    "const",
+    "id",
+    "add",
+    "sub",
+    "mul",
+    "eq",
+    "lt",
+    "gt",
+    "le",
+    "ge",
+    "not",
+    "and",
+    "or",
+    "fadd",
+    "fsub",
+    "fmul",
+    "fdiv",
+    "feq",
+    "flt",
+    "fgt",
+    "fle",
+    "fge",
+    "ceq",
+    "clt",
+    "cgt",
+    "cle",
+    "cge",
+    "char2int",
+    "ptradd",
+}
 
-    for i, func in enumerate(prog["functions"]):
-        bb = BasicBlocks(func)
-        # bb.to_ssa()
-        # dataflow_dce(bb)
+# pure, but they can fail, so they're only hoisted from the start of the
+# header, where nothing the loop does can be seen before them
+_trapping_ops = {"div", "int2char"}
 
-        print("Basic Blocks:", file=sys.stderr)
 
-        print("succ:", bb.succ, file=sys.stderr)
-        print("pred:", bb.pred, file=sys.stderr)
+class _Dominance:
+    """
+    dominance in bb's dominator tree as it was when this was made, so
+    licm_pass can keep asking while preheaders go in, without recomputing it
+    after each one. a preheader added since sits right above its header: it
+    dominates what the header does, and is dominated by what dominated the
+    header.
+    """
 
-        natural_loops = find_natural_loops(bb)
-        print("natural loops:", natural_loops, file=sys.stderr)
+    def __init__(self, bb):
+        self.pre = bb._dt_pre
+        self.post = bb._dt_post
+        self.header_of = {}
 
-        in_reaching, out_reaching = dataflow(bb, Reaching)
+    def add_preheader(self, pre, header):
+        self.header_of[pre] = header
+
+    def reachable(self, a):
+        return self.pre[self.header_of.get(a, a)] is not None
+
+    def strictly_dominates(self, a, b):
+        ha, hb = self.header_of.get(a, a), self.header_of.get(b, b)
+        if ha == hb:
+            return a != b and a in self.header_of
+        if self.pre[ha] is None or self.pre[hb] is None:
+            return False
+        return self.pre[ha] < self.pre[hb] and self.post[hb] < self.post[ha]
+
+    def order(self, blocks):
+        """blocks in dominator tree preorder, so each after its dominators"""
+        return sorted(
+            blocks,
+            key=lambda a: (self.pre[self.header_of.get(a, a)], a not in self.header_of),
+        )
+
+
+def licm(bb, loop, dom=None, live_in=None):
+    """
+    hoists the loop invariant instructions of loop into its preheader,
+    inserting one unless it has one that dominates the header. returns the
+    preheader's index, or None if nothing moved. licm_pass passes dom, a
+    _Dominance, and live_in, the liveness at block entries, both from before
+    its first edit.
+
+    an instruction d = op args is invariant if each arg is only reached by
+    definitions outside the loop, or by a single one that's hoisted already.
+    it's hoisted if d has no other definition in the loop, every use of d
+    in the loop sees only this one, and it either dominates every exit of
+    the loop or can't fail and d is dead once the loop is left. an op that
+    can fail, like div, has to come before anything with an effect in the
+    header. the blocks are visited in dominator tree preorder, so hoisted
+    code still comes after the code it uses.
+
+    the reaching definitions come from dominance rather than a dataflow
+    run: a variable assigned in the loop reaches every use in the loop
+    around the back edge, so a use sees only outside definitions if the
+    loop doesn't assign its variable, and a single definition if that's
+    the only one in the loop and dominates the use.
+    """
+    if dom is None:
+        dom = _Dominance(bb)
+    order = dom.order(loop.body)
+    defs = defaultdict(list)  # var -> its (block, index) defs in the loop
+    uses = defaultdict(list)
+    for a in order:
+        for k, instr in enumerate(bb.blocks[a]):
+            for arg in instr.get("args", ()):
+                uses[arg].append((a, k))
+            if "dest" in instr:
+                defs[instr["dest"]].append((a, k))
 
-        labels = set()
-        for b in bb.blocks:
-            if len(b) == 0:
+    def dominates(d, u):
+        (a, k), (b, j) = d, u
+        return k < j if a == b else dom.strictly_dominates(a, b)
+
+    exiting = {e for e, _ in loop.exits}
+
+    def dominates_exits(a):
+        return all(a == e or dom.strictly_dominates(a, e) for e in exiting)
+
+    def dead_after(dest):
+        nonlocal live_in
+        if live_in is None:
+            live_in, _ = dataflow(bb, Liveness)
+        return not any(live_in.holds(s, dest) for _, s in loop.exits)
+
+    hoisted = set()
+    moved = []
+
+    def invariant(arg, u):
+        if arg not in defs:
+            return True
+        d = defs[arg]
+        return len(d) == 1 and d[0] in hoisted and dominates(d[0], u)
+
+    for a in order:
+        in_all = dominates_exits(a)
+        quiet = a == loop.header  # nothing the loop did can be seen yet
+        for k, instr in enumerate(bb.blocks[a]):
+            op = instr.get("op")
+            if op in _trapping_ops:
+                if not quiet:
+                    continue
+            elif op not in _pure_ops:
+                if "label" not in instr:
+                    quiet = False
+                continue
+            if not all(invariant(arg, (a, k)) for arg in instr.get("args", ())):
                 continue
-            if "label" not in b[0]:
+            dest = instr["dest"]
+            if len(defs[dest]) != 1:
                 continue
-            labels.add(b[0]["label"])
+            if not all(dominates((a, k), u) for u in uses[dest]):
+                continue
+            if not (in_all or dead_after(dest)):
+                continue
+            hoisted.add((a, k))
+            moved.append(instr)
+
+    if not moved:
+        return None
+    for a in order:
+        bb.blocks[a] = [
+            instr for k, instr in enumerate(bb.blocks[a]) if (a, k) not in hoisted
+        ]
+    metrics.count("licm.hoisted", len(moved))
+
+    # a preheader that's dead or can be bypassed would run the code on the
+    # wrong paths, so those get a fresh one
+    p = loop.preheader
+    if p is not None and dom.strictly_dominates(p, loop.header):
+        block = bb.blocks[p]
+        if block and block[-1].get("op") in ("jmp", "br"):
+            block[-1:-1] = moved
+        else:
+            block.extend(moved)
+        return p
+
+    header = loop.header
+    label = bb.fresh_label(bb.label_of(header) + ".preheader")
+    pre = bb.insert_block([{"label": label}] + moved, at=header)
+    body = loop.body
+    if pre == 0:
+        # the preheader took over as the entry, the header got a new index.
+        # no other loop holds the entry, so nothing asks about them again
+        header = bb.n - 1
+        body = {header if a == 0 else a for a in body}
+    else:
+        dom.add_preheader(pre, header)
+        outer = loop.parent
+        while outer is not None:
+            outer.body.add(pre)
+            outer = outer.parent
+    loop.preheader = pre
+    # entries into the loop go through the preheader, back edges and dead
+    # blocks don't
+    for p in list(bb.pred[header]):
+        if p != pre and p not in body and dom.reachable(p):
+            bb.redirect(p, header, pre)
+    for p in list(bb.pred[pre]):
+        if p in body:
+            bb.redirect(p, pre, header)
+    return pre
 
-        for a, b in natural_loops:
-            licm(bb, natural_loops[(a, b)], in_reaching, out_reaching, a, b, labels)
 
-        # bb.from_ssa()
-        # dataflow_dce(bb)
-        prog["functions"][i] = bb.to_func()
+def licm_pass(bb):
+    """
+    hoists loop invariant code out of every natural loop into a preheader,
+    inner loops first, so code hoisted into an inner loop's preheader can
+    move on out of the loops around it. preheaders are inserted into bb's
+    cfg in place.
 
-        # print("in_reaching:", in_reaching)
-        # print("out_reaching:", out_reaching)
+    the loop forest, dominators and liveness are computed once, up front.
+    block numbers stay put as preheaders go in, and licm keeps the forest
+    and dominators up to date. liveness only changes inside the loop code
+    is hoisted out of and at its new preheader, which no later loop asks
+    about: an outer loop's exits lie outside it, and an edge that entered
+    the loop's header from outside now enters the preheader, live the same.
+    """
+    forest = bb.loop_forest
+    metrics.count("licm.loops", len(forest))
+    if not len(forest):
+        return bb
+    dom = _Dominance(bb)
+    live_in, _ = dataflow(bb, Liveness)
+    for loop in forest:
+        licm(bb, loop, dom, live_in)
+    return bb
 
-        print(file=sys.stderr)
 
-    print(json.dumps(prog))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.from_args(args)
+
+    stages = [("licm", licm_pass, None)]
+    cache.run_stream(sys.stdin, sys.stdout, stages, args.jobs, cache.from_args(args))
+    metrics.emit()
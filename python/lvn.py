@@ -1,16 +1,19 @@
-import json
 import sys
-from copy import deepcopy
 import argparse
+from collections import defaultdict
 
-from blocks import BasicBlocks
+import cache
+import metrics
+from bril import eval_op
+
+default_opts = ["copy_prop", "commutativity", "const_prop", "const_fold"]
 
 
 def _reconstruct_args(instr, table, var2num, active_opt):
     if active_opt is None:
         active_opt = []
 
-    new_instr = deepcopy(instr)
+    new_instr = dict(instr)
     # print("reconstruct, instr:", instr)
     op = instr["op"]
     if op == "const":
@@ -41,10 +44,8 @@ def _reconstruct_args(instr, table, var2num, active_opt):
     #         new_instr["value"] = val[1]
     #     return new_instr
 
-    for i, arg in enumerate(instr.get("args", [])):
-        num = var2num[arg]
-        val, var = table[num]
-        new_instr["args"][i] = var
+    if "args" in instr:
+        new_instr["args"] = [table[var2num[arg]][1] for arg in instr["args"]]
     return new_instr
 
 
@@ -58,61 +59,102 @@ def _fresh():
 def _is_const(var, table, var2num):
     num = var2num[var]
     val, var = table[num]
-    cond = isinstance(val, tuple) and val[0] == "const"
-    if debug_mode:
-        print("is_const", cond, var, table)
-
     return isinstance(val, tuple) and val[0] == "const"
 
 
+def _const_key(const):
+    # True == 1 in python, so the type keeps bool and int constants apart
+    return ("const", const, type(const))
+
+
+def value_key(op, args, value=None, active_opt=()):
+    """
+    the table key for op applied to args. args are value numbers, or anything
+    else hashable that names a value (gvn uses ssa names).
+    """
+    if op == "const":
+        return _const_key(value)
+    key = [op, *args]
+    if value is not None:
+        key.append(value)
+    if "commutativity" in active_opt and op in commutative_ops:
+        key[1:] = sorted(key[1:])
+    return tuple(key)
+
+
+# ops whose result isn't determined by their args alone, never reused
+no_cse_ops = {"call", "get", "alloc", "load", "undef"}
+
+fold_ops = {
+    "add",
+    "sub",
+    "mul",
+    "div",
+    "eq",
+    "lt",
+    "gt",
+    "le",
+    "ge",
+    "not",
+    "and",
+    "or",
+}
+
+commutative_ops = {"add", "mul", "eq", "and", "or"}
+
+
 def lvn(instrs, active_opt):
     """Takes in list of instructions, returns a list of optimized instructions."""
 
+    # table[num] = (value, holder). holder is the variable the value is read
+    # from, or None once every variable holding it has been overwritten.
     table = []
     var2num = {}
+    # reverse indexes, so lookups and reassignments don't scan the table
+    value2num = {}
+    holders = defaultdict(dict)  # num -> variables holding it, in order
+
+    def bind(var, num):
+        old = var2num.get(var)
+        if old == num:
+            return
+        if old is not None:
+            del holders[old][var]
+            if table[old][1] == var:
+                replacement = next(iter(holders[old]), None)
+                table[old] = (table[old][0], replacement)
+        var2num[var] = num
+        holders[num][var] = None
 
     output = []
+    folded = reused = 0
 
     for instr in instrs:
         if "label" in instr:
             output.append(instr)
-            if debug_mode:
-                print(instr, "exit cuz label")
             continue
 
         assert "op" in instr
 
-        # print("instr:", instr)
-        # no_def = ["print", "nop", "ret", "br", "jmp"]
-        commutative_ops = ["add", "mul", "eq"]
-        value = [instr["op"]]
         for arg in instr.get("args", ()):
             if arg not in var2num:
-                i = len(table)
                 assert arg is not None, arg
                 table.append((arg, arg))  # first arg just has to be "fresh"
-                var2num[arg] = i
-
-            value.append(var2num[arg])
-        if "value" in instr:
-            value.append(instr["value"])
-        if "commutativity" in active_opt and instr["op"] in commutative_ops:
-            value[1:] = sorted(value[1:])
-            if debug_mode:
-                print("commutative: ", value)
-        value = tuple(value)
+                bind(arg, len(table) - 1)
+        value = value_key(
+            instr["op"],
+            [var2num[arg] for arg in instr.get("args", ())],
+            instr.get("value"),
+            active_opt,
+        )
 
         if "dest" not in instr:
             output.append(_reconstruct_args(instr, table, var2num, active_opt))
-            if debug_mode:
-                print(instr, "exit cuz should_exist_already")
             continue
 
-        # assert not ((instr.get("value", None)) and (not instr.get("args", None))), instr
-
-        assert "dest" in instr, instr
         if instr["op"] == "id" and "copy_prop" in active_opt:
-            instr = deepcopy(instr)
+            instr = dict(instr)
+            instr["args"] = list(instr["args"])
             repeat = True
             while repeat:
                 assert instr["args"][0] is not None, str(instr) + " " + str(table)
@@ -124,8 +166,6 @@ def lvn(instrs, active_opt):
                     and table[val[1]][1] is not None
                 ):
                     instr["args"][0] = table[val[1]][1]
-                    if debug_mode:
-                        print("repeating", instr, val, var, table)
                 else:
                     repeat = False
         if instr["op"] == "id" and "const_prop" in active_opt:
@@ -133,144 +173,76 @@ def lvn(instrs, active_opt):
             num = var2num[instr["args"][0]]
             val, var = table[num]
             if isinstance(val, tuple) and val[0] == "const":
-                instr: dict = deepcopy(instr)
+                instr = dict(instr)
                 instr.pop("args")
                 instr["op"] = "const"
                 instr["value"] = val[1]
-
-        if "const_fold" in active_opt:
-            valid_ops = [
-                "add",
-                "sub",
-                "mul",
-                "div",
-                "eq",
-                "lt",
-                "gt",
-                "le",
-                "ge",
-                "not",
-                "and",
-                "or",
-            ]
-            if all(_is_const(var, table, var2num) for var in instr.get("args", ())):
-                if instr["op"] in valid_ops:
-                    if debug_mode:
-                        print("const_fold begin", instr)
-                    instr = deepcopy(instr)
-                    args = []
-                    for arg in instr["args"]:
-                        num = var2num[arg]
-                        args.append(table[num][0][1])
-                    if debug_mode:
-                        print("argsa", args)
-                    match instr["op"]:
-                        case "add":
-                            const = args[0] + args[1]
-                        case "sub":
-                            const = args[0] - args[1]
-                        case "mul":
-                            const = args[0] * args[1]
-                        case "div":
-                            const = args[0] // args[1]
-                        case "eq":
-                            const = args[0] == args[1]
-                        case "lt":
-                            const = args[0] < args[1]
-                        case "le":
-                            const = args[0] <= args[1]
-                        case "gt":
-                            const = args[0] > args[1]
-                        case "ge":
-                            const = args[0] >= args[1]
-                        case "and":
-                            const = args[0] and args[1]
-                        case "or":
-                            const = args[0] or args[1]
-                        case "not":
-                            const = args[0]
-                    instr["op"] = "const"
-                    instr.pop("args")
-                    instr["value"] = const
-                    value = ("const", const)
-                    if debug_mode:
-                        print("const_fold end", instr)
-                        print("const_fold")
-
-        in_table = False
-        for i in range(len(table)):
-            if ("const_fold") in active_opt and table[i][0][0] == "const":
-                continue
-            if (
-                value == table[i][0]
-                and not (
-                    table[i][0][0] == "const" and type(value[1]) != type(table[i][0][1])
-                )
-                and table[i][1] is not None
-            ):
-                # instr = _reconstruct_args(instr, table, var2num, active_opt)
-                if debug_mode:
-                    print("match", table[i], value)
-                instr["op"] = "id"
-                instr["args"] = [table[i][1]]
-                var2num[instr["dest"]] = i
-                in_table = True
-                output.append(instr)
-                break
-        if in_table:
+                value = val
+
+        if (
+            "const_fold" in active_opt
+            and instr["op"] in fold_ops
+            and all(_is_const(var, table, var2num) for var in instr["args"])
+        ):
+            args = [table[var2num[arg]][0][1] for arg in instr["args"]]
+            const = eval_op(instr["op"], args)
+            if const is not None:  # e.g. division by zero, leave it to brili
+                instr = dict(instr)
+                instr["op"] = "const"
+                instr.pop("args")
+                instr["value"] = const
+                value = _const_key(const)
+                folded += 1
+
+        num = None if instr["op"] in no_cse_ops else value2num.get(value)
+        if "const_fold" in active_opt and value[0] == "const":
+            num = None  # a const is as cheap as an id, and folds further
+        if num is not None and table[num][1] is not None:
+            instr = dict(instr)
+            instr["op"] = "id"
+            instr["args"] = [table[num][1]]
+            instr.pop("value", None)
+            bind(instr["dest"], num)
+            output.append(instr)
+            reused += 1
             continue
 
-        # assert instr["op"] != "const", value
+        # args are read before dest is written, so rename them first
+        new_instr = _reconstruct_args(instr, table, var2num, active_opt)
+
         dest = instr["dest"]
-        if dest in var2num:
-            curr_num = var2num[dest]
-            replacement = None
-            for i in var2num:
-                if var2num[i] == curr_num and i != dest:
-                    replacement = i
-                    break
-            if debug_mode:
-                print("replace", instr, replacement, table)
-            table[curr_num] = (table[curr_num][0], replacement)
-
-        var2num[dest] = len(table)
-        assert value is not None and dest is not None, str(value) + " " + str(dest)
-        if debug_mode:
-            print("append", instr, value, dest)
+        num = len(table)
         table.append((value, dest))
-        if debug_mode:
-            print("table")
-            for i in table:
-                print("table", i)
-            print("table var2num", var2num)
+        bind(dest, num)
+        if instr["op"] not in no_cse_ops:
+            value2num[value] = num
 
-        output.append(_reconstruct_args(instr, table, var2num, active_opt))
+        output.append(new_instr)
 
+    metrics.count("lvn.folded", folded)
+    metrics.count("lvn.reused", reused)
     return output
 
 
-if __name__ == "__main__":
-    global debug_mode
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--debug", action="store_true")
-    args = parser.parse_args()
-    debug_mode = args.debug
+def lvn_pass(bb, active_opts=None):
+    if active_opts is None:
+        active_opts = default_opts
 
-    prog = json.load(sys.stdin)
+    for i, block in enumerate(bb.blocks):
+        bb.blocks[i] = lvn(block, active_opts)
+    return bb
 
-    active_opts = []
-    active_opts.append("copy_prop")
-    active_opts.append("commutativity")
-    active_opts.append("const_prop")
-    active_opts.append("const_fold")
 
-    for func in prog["functions"]:
-        blocks = BasicBlocks(func)
-        new_instrs = []
-
-        for instrs in blocks.blocks:
-            new_instrs += lvn(instrs, active_opts)
-
-        func["instrs"] = new_instrs
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.from_args(args)
 
-    print(json.dumps(prog))
+    stages = [("lvn", lvn_pass, None)]
+    cache.run_stream(sys.stdin, sys.stdout, stages, args.jobs, cache.from_args(args))
+    metrics.emit()
@@ -0,0 +1,94 @@
+"""
+Timers and counters for finding out where an optimization run spends its
+time, printed as json by --stats:
+
+    {"timers": {"cfg": 0.012, "dataflow.Faint": 0.031, ...},
+     "counters": {"dataflow.visits": 1234, "dce.removed": 56, ...}}
+
+Timers add up seconds per name, counters add up ints. Both are no-ops until
+enable() is called, and neither is meant for a hot loop: code counts in a
+local and reports once, e.g. at the end of a dataflow run.
+"""
+
+import json
+import sys
+import time
+from collections import defaultdict
+
+enabled = False
+timers = defaultdict(float)
+counters = defaultdict(int)
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        timers[self.name] += time.perf_counter() - self.start
+
+
+class _NoTimer:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_no_timer = _NoTimer()
+
+
+def timer(name: str):
+    """with timer("cfg"): ... adds the block's wall clock time to "cfg" """
+    return _Timer(name) if enabled else _no_timer
+
+
+def count(name: str, n: int = 1):
+    if enabled:
+        counters[name] += n
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def take() -> dict:
+    """the metrics so far, resetting them"""
+    report = {"timers": dict(timers), "counters": dict(counters)}
+    timers.clear()
+    counters.clear()
+    return report
+
+
+def merge(report: dict):
+    """adds a report from take(), e.g. one made in a worker process"""
+    for name, t in report["timers"].items():
+        timers[name] += t
+    for name, n in report["counters"].items():
+        counters[name] += n
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--stats", action="store_true", help="print timers and counters to stderr"
+    )
+
+
+def from_args(args):
+    if args.stats:
+        enable()
+
+
+def emit(file=sys.stderr):
+    if enabled:
+        report = take()
+        report["timers"] = dict(sorted(report["timers"].items()))
+        report["counters"] = dict(sorted(report["counters"].items()))
+        print(json.dumps(report, indent=2), file=file)
@@ -0,0 +1,114 @@
+"""
+Runs a per-function transformation over a whole program, optionally on a pool
+of worker processes.
+
+The workers are forked after the program is parsed, so they read their
+functions straight out of the parent's memory. Only the transformed functions
+are pickled on the way back, and they're put back in their original order.
+With metrics enabled, each result comes back with the worker's timers and
+counters, which are merged into the parent's.
+imap does the same for items that are still being read, like the functions
+of a program being streamed in (stream.py) or benchmarks (bench.py).
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+# set just before the pool forks, read by the workers
+_funcs = None
+_transform = None
+
+
+def _run(i):
+    return _apply(_funcs[i])
+
+
+def _apply(item):
+    result = _transform(item)
+    if metrics.enabled:
+        return result, metrics.take()
+    return result
+
+
+def _collect(result):
+    if metrics.enabled:
+        result, report = result
+        metrics.merge(report)
+    return result
+
+
+def _jobs(jobs, n=None):
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if n is not None:
+        jobs = min(jobs, n)
+    # without fork the workers would have to unpickle the transform, so just
+    # stay serial there
+    if "fork" not in multiprocessing.get_all_start_methods():
+        jobs = 1
+    return jobs
+
+
+def map_functions(prog, transform, jobs=1):
+    """
+    replaces every function of prog with transform(func) and returns prog.
+    jobs > 1 spreads the functions over that many processes, jobs = 0 uses
+    every cpu. transform can be any callable, even a lambda, since it's
+    inherited rather than pickled.
+    """
+    global _funcs, _transform
+
+    funcs = prog["functions"]
+    jobs = _jobs(jobs, len(funcs))
+    if jobs <= 1:
+        prog["functions"] = [transform(func) for func in funcs]
+        return prog
+
+    _funcs, _transform = funcs, transform
+    try:
+        ctx = multiprocessing.get_context("fork")
+        # the workers start from the parent's metrics, so clear their copy
+        with ProcessPoolExecutor(
+            jobs, mp_context=ctx, initializer=metrics.take
+        ) as pool:
+            chunksize = max(1, len(funcs) // (4 * jobs))
+            results = pool.map(_run, range(len(funcs)), chunksize=chunksize)
+            prog["functions"] = [_collect(r) for r in results]
+    finally:
+        _funcs = _transform = None
+    return prog
+
+
+def imap(items, transform, jobs=1):
+    """
+    yields transform(item) for every item of the iterator items, in order.
+    with jobs > 1 the items are sent to worker processes, but only a couple
+    per worker are read ahead, so memory stays bounded by the items in
+    flight rather than all of them.
+    """
+    global _transform
+
+    jobs = _jobs(jobs)
+    if jobs <= 1:
+        yield from map(transform, items)
+        return
+
+    _transform = transform
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(
+            jobs, mp_context=ctx, initializer=metrics.take
+        ) as pool:
+            pending = deque()
+            for item in items:
+                pending.append(pool.submit(_apply, item))
+                if len(pending) >= 2 * jobs:
+                    yield _collect(pending.popleft().result())
+            while pending:
+                yield _collect(pending.popleft().result())
+    finally:
+        _transform = None
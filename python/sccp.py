@@ -0,0 +1,247 @@
+"""
+Sparse conditional constant propagation (Wegman and Zadeck) over the SSA form
+made by BasicBlocks.to_ssa().
+
+Values flow along def-use edges instead of being recomputed for every block,
+and a block is only evaluated once some cfg edge into it is known to execute.
+So constants feeding a branch prune the untaken side, and values that only
+reach a phi along pruned edges don't spoil it, even from a block that runs.
+
+    bril2json < prog.bril | python3 sccp.py | brili -p
+"""
+
+import argparse
+import sys
+from collections import defaultdict, deque
+
+import cache
+import metrics
+from blocks import from_ssa, to_ssa
+from bril import eval_op
+
+
+class _Top:
+    def __repr__(self):
+        return "TOP"
+
+
+class _Bottom:
+    def __repr__(self):
+        return "BOTTOM"
+
+
+TOP = _Top()  # no value seen yet
+BOTTOM = _Bottom()  # not a constant
+
+
+def _same_const(a, b):
+    # True == 1 in python, but a bool and an int are different bril values
+    return type(a) is type(b) and a == b
+
+
+def _meet(a, b):
+    if a is TOP:
+        return b
+    if b is TOP or a is b:
+        return a
+    if a is BOTTOM or b is BOTTOM or not _same_const(a, b):
+        return BOTTOM
+    return a
+
+
+def _const_type(value):
+    return "bool" if isinstance(value, bool) else "int"
+
+
+def sccp(bb):
+    """
+    rewrites instructions whose result is a constant into const, turns
+    branches on a constant into jumps and deletes the blocks that can't be
+    reached anymore. bb has to be in SSA form, its cfg is edited in place.
+    """
+    blocks = bb.blocks
+
+    # a block can carry more than one label, so map all of them
+    label_block = {}
+    for i, b in enumerate(blocks):
+        for instr in b:
+            if "label" in instr:
+                label_block[instr["label"]] = i
+
+    # def-use edges. sets feed the gets of their shadow variable in the
+    # blocks the set's block jumps to.
+    ndefs = defaultdict(int)
+    uses = defaultdict(list)  # var -> [(block, instr)]
+    sets = defaultdict(list)  # shadow -> [(block, set instr)]
+    gets = defaultdict(list)  # shadow -> [(block, get instr)]
+    block_sets = defaultdict(list)  # (block, shadow) -> its set instrs
+    block_gets = defaultdict(list)  # block -> its get instrs
+    for i, b in enumerate(blocks):
+        for instr in b:
+            if "dest" in instr:
+                ndefs[instr["dest"]] += 1
+            op = instr.get("op")
+            if op == "set":
+                shadow, arg = instr["args"]
+                sets[shadow].append((i, instr))
+                block_sets[i, shadow].append(instr)
+                uses[arg].append((i, instr))
+            elif op == "get":
+                gets[instr["dest"]].append((i, instr))
+                block_gets[i].append(instr)
+            else:
+                for arg in instr.get("args", ()):
+                    uses[arg].append((i, instr))
+
+    value = defaultdict(lambda: TOP)
+    for v in bb.fun_args:
+        value[v] = BOTTOM
+    for v, n in ndefs.items():
+        if n > 1:  # not actually SSA, don't guess
+            value[v] = BOTTOM
+
+    # a block is executable once an edge into it is. the entry has a
+    # pseudo edge from None.
+    executable = [False] * bb.n
+    edges = set()  # the executable (pred, succ) edges
+    edge_work = deque([(None, 0)] if bb.n else [])
+    var_work = deque()
+
+    def lower(var, new):
+        # _meet hands back its first argument whenever nothing changed
+        new = _meet(value[var], new)
+        if new is not value[var]:
+            value[var] = new
+            var_work.append(var)
+
+    def evaluate(j, instr):
+        op = instr["op"]
+        if op == "const":
+            return instr["value"]
+        if op == "undef":
+            return TOP
+        if op == "get":
+            # only sets on an executable edge into the get's block count
+            out = TOP
+            for i, s in sets[instr["dest"]]:
+                if (i, j) in edges:
+                    out = _meet(out, value[s["args"][1]])
+            return out
+
+        args = [value[a] for a in instr.get("args", ())]
+        if any(a is BOTTOM for a in args):
+            return BOTTOM
+        if any(a is TOP for a in args):
+            return TOP
+        folded = eval_op(op, args)
+        return BOTTOM if folded is None else folded
+
+    def mark(i, j):
+        if (i, j) not in edges:
+            edge_work.append((i, j))
+
+    def visit_terminator(i):
+        last = blocks[i][-1] if blocks[i] else {}
+        op = last.get("op")
+        if op == "jmp":
+            mark(i, label_block[last["labels"][0]])
+        elif op == "br":
+            cond = value[last["args"][0]]
+            if cond is BOTTOM:
+                for label in last["labels"]:
+                    mark(i, label_block[label])
+            elif cond is not TOP:
+                mark(i, label_block[last["labels"][0 if cond else 1]])
+        elif op != "ret":
+            for j in bb.succ[i]:
+                mark(i, j)
+
+    def visit(i, instr):
+        op = instr.get("op")
+        if op == "set":
+            # values only go down, so meeting in this one set's value is the
+            # same as meeting all of them again
+            shadow, arg = instr["args"]
+            for k, get in gets[shadow]:
+                if (i, k) in edges:
+                    lower(get["dest"], value[arg])
+        elif op in ("br", "jmp"):
+            visit_terminator(i)
+        elif "dest" in instr and ndefs[instr["dest"]] == 1:
+            lower(instr["dest"], evaluate(i, instr))
+
+    while edge_work or var_work:
+        while edge_work:
+            i, j = edge_work.popleft()
+            if (i, j) in edges:
+                continue
+            edges.add((i, j))
+            if executable[j]:
+                # the block's been visited, only its gets see the new edge
+                for get in block_gets[j]:
+                    for s in block_sets[i, get["dest"]]:
+                        lower(get["dest"], value[s["args"][1]])
+                continue
+            executable[j] = True
+            for instr in blocks[j]:
+                visit(j, instr)
+            visit_terminator(j)
+
+        while var_work:
+            var = var_work.popleft()
+            for i, instr in uses[var]:
+                if executable[i]:
+                    visit(i, instr)
+
+    folded = 0
+    constant_branches = []  # (block, target dropped, target kept)
+    for i, b in enumerate(blocks):
+        if not executable[i]:
+            continue
+
+        for k, instr in enumerate(b):
+            v = value[instr["dest"]] if "dest" in instr else TOP
+            if v is not TOP and v is not BOTTOM and instr.get("op") != "const":
+                b[k] = {
+                    "dest": instr["dest"],
+                    "type": instr.get("type", _const_type(v)),
+                    "op": "const",
+                    "value": v,
+                }
+                folded += 1
+            elif instr.get("op") == "br":
+                cond = value[instr["args"][0]]
+                if cond is not TOP and cond is not BOTTOM:
+                    taken, other = instr["labels"] if cond else instr["labels"][::-1]
+                    constant_branches.append(
+                        (i, label_block[other], label_block[taken])
+                    )
+
+    for i, other, taken in constant_branches:
+        if other != taken:
+            bb.redirect(i, other, taken)
+    dead = bb.del_unreachable_blocks()
+
+    metrics.count("sccp.folded", folded)
+    metrics.count("sccp.branches", len(constant_branches))
+    metrics.count("sccp.unreachable", len(dead))
+    return bb
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.from_args(args)
+
+    stages = [
+        ("to_ssa", to_ssa, None),
+        ("sccp", sccp, None),
+        ("from_ssa", from_ssa, None),
+    ]
+    cache.run_stream(sys.stdin, sys.stdout, stages, args.jobs, cache.from_args(args))
+    metrics.emit()
@@ -0,0 +1,111 @@
+"""
+Reads and writes Bril json one function at a time.
+
+json.load(sys.stdin) holds the whole program, and json.dumps(prog) the whole
+output on top of it. stream_program instead decodes each function as soon as
+its text has arrived, hands it on, and writes the result out right away, so
+memory only has to fit the largest function. The output is byte for byte what
+print(json.dumps(prog)) would give.
+
+    stream_program(sys.stdin, sys.stdout, lambda funcs: map(optimize, funcs))
+"""
+
+import json
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\n\r"
+
+
+class _Reader:
+    def __init__(self, f, chunk=1 << 16):
+        self.f = f
+        self.chunk = chunk
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _more(self):
+        # drop what's been consumed, then append the next chunk. the chunk is
+        # at least as long as what's still pending, so a long value's buffer
+        # doubles each time and copying it stays linear overall
+        data = self.f.read(max(self.chunk, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos :] + data
+        self.pos = 0
+        if not data:
+            self.eof = True
+
+    def peek(self) -> str:
+        """the next non-whitespace character, "" at the end of input"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos : self.pos + 1]
+            self._more()
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f"expected one of {chars!r}, got {c!r}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        # a failed decode is retried only once the unread text has doubled,
+        # so a long function is decoded O(1) times rather than once per chunk
+        want = 0
+        while True:
+            if len(self.buf) - self.pos >= want or self.eof:
+                try:
+                    value, end = _decoder.raw_decode(self.buf, self.pos)
+                except json.JSONDecodeError:
+                    if self.eof:
+                        raise
+                else:
+                    # a number at the very end might continue in the next chunk
+                    if end < len(self.buf) or self.eof:
+                        self.pos = end
+                        return value
+                want = 2 * (len(self.buf) - self.pos)
+            self._more()
+
+
+def stream_program(infile, outfile, process):
+    """
+    copies the program in infile to outfile, passing its functions through
+    process, which maps an iterator of functions to an iterator of their
+    replacements, in order. other top level keys are copied as they are.
+    """
+    reader = _Reader(infile)
+    reader.expect("{")
+    outfile.write("{")
+    first = True
+    while reader.peek() != "}":
+        if not first:
+            reader.expect(",")
+        key = reader.value()
+        reader.expect(":")
+        outfile.write(("" if first else ", ") + json.dumps(key) + ": ")
+        first = False
+
+        if key != "functions":
+            outfile.write(json.dumps(reader.value()))
+            continue
+
+        def functions():
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+                return
+            while True:
+                yield reader.value()
+                if reader.expect(",]") == "]":
+                    return
+
+        outfile.write("[")
+        for i, func in enumerate(process(functions())):
+            outfile.write((", " if i else "") + json.dumps(func))
+        outfile.write("]")
+    reader.expect("}")
+    outfile.write("}\n")
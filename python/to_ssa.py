@@ -1,28 +1,22 @@
-from blocks import BasicBlocks
+import argparse
+import sys
 
+import cache
+import metrics
+from blocks import SSA_MODES, to_ssa
 
-if __name__ == "__main__":
-    import json, sys
-
-    prog = json.load(sys.stdin)
-
-    for i, func in enumerate(prog["functions"]):
-        bb = BasicBlocks(func)
-        # for b in bb.blocks:
-        #     # print(b)
-        #     [print(i) for i in b]
-        #     print()
-        # print()
 
-        # print("==== CONVERT TO SSA ==== ")
-        # print(bb.n)
-        # print(bb.blocks)
-        bb.to_ssa()
-        # for b in bb.blocks:
-        #     # print(b)
-        #     [print(i) for i in b]
-        #     print()
-
-        prog["functions"][i] = bb.to_func()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=SSA_MODES, default="pruned")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.from_args(args)
 
-    print(json.dumps(prog))
+    stages = [("to_ssa", lambda bb: to_ssa(bb, args.mode), {"mode": args.mode})]
+    cache.run_stream(sys.stdin, sys.stdout, stages, args.jobs, cache.from_args(args))
+    metrics.emit()
@@ -1,111 +1,108 @@
-import json
+import argparse
 import sys
-from collections import defaultdict, deque
+from collections import defaultdict
 
+import cache
+import metrics
 from blocks import *
 
 
-def _one_pass(instrs):
-    unused_vars = set()
-    output = []
-    changed = False
-    for i in range(len(instrs) - 1, -1, -1):
-        instr = instrs[i]
-
-        if "dest" in instr:
-            dest = instr["dest"]
-            if dest in unused_vars:
-                changed = True
+# ops with an effect besides their dest, kept even when nothing reads it
+critical_ops = {"call", "alloc", "load"}
+
+
+def tdce(bb):
+    """
+    mark and sweep dce. starts from the instructions that have to stay
+    (no dest, or a side effect) and marks whatever they read, following def
+    use chains, then drops everything unmarked. dead chains go in one pass.
+
+    a use before any def in its own block depends on every def that is the
+    last of its variable in some block, that's all that can reach it. in SSA
+    form a set is live when a get of its variable is.
+    """
+    sites = []  # instruction number -> (block, index)
+    deps = []  # instruction number -> sites it reads, or a var for "any def"
+    exposed = defaultdict(list)  # var -> sites of the last def in each block
+    sets = defaultdict(list)  # shadow var -> sites of its sets
+    work = []
+
+    for i, block in enumerate(bb.blocks):
+        last = {}
+        for k, instr in enumerate(block):
+            if "op" not in instr:
+                # a label mid-block may still be a jump target
+                for var, site in last.items():
+                    exposed[var].append(site)
+                last = {}
                 continue
-            else:
-                unused_vars.add(dest)
-
-        output.append(instr)
-
-        for arg in instr.get("args", ()):
-            if arg in unused_vars:
-                unused_vars.remove(arg)
-
-    return output[::-1], changed
-
-
-def local_dce(instrs):
-    changed = True
-    limit = float("inf")
-    while changed and limit:
-        instrs, changed = _one_pass(instrs)
-        limit -= 1
-    return instrs
-
-
-def global_dce(instrs):
-    used = set()
-    for _, instr in enumerate(instrs):
-        for arg in instr.get("args", ()):
-            used.add(arg)
-
-    output = []
-    for instr in instrs:
-        if "dest" in instr and instr["dest"] not in used:
-            continue
-        output.append(instr)
-    return output
-
-
-def global_dce2(instrs):
-    def_loc = defaultdict(set)
-    use_loc = defaultdict(set)
-    for i, instr in enumerate(instrs):
-        if "dest" in instr:
-            def_loc[instr["dest"]].add(i)
-        for arg in instr.get("args", ()):
-            use_loc[arg].add(i)
-
-    queue = deque()
-    for i, instr in enumerate(instrs):
-        if "dest" in instr and not use_loc[instr["dest"]]:
-            queue.append(i)
-
-    removed = set()
-    while queue:
-        j = queue.popleft()
-        instr = instrs[j]
-        if "dest" not in instrs[j]:
-            continue
-
-        removed.add(j)
-        if instr["op"] == "const":
-            continue
-
-        var = instrs[j]["dest"]
-        used = False
-        # assert False, type(use_loc)
-        for i in use_loc[var]:
-            if i not in removed:
-                used = True
-        if used:
-            continue
-
-        for i in def_loc[var]:
-            for arg in instr.get("args", ()):
-                queue.append(i)
-    output = []
-    for i, instr in enumerate(instrs):
-        if i not in removed:
-            output.append(instr)
-    return output
+            site = len(sites)
+            sites.append((i, k))
+
+            op = instr["op"]
+            args = instr.get("args", ())
+            if op == "set":
+                sets[args[0]].append(site)
+                args = args[1:]
+            deps.append([last.get(arg, arg) for arg in args])
+
+            if "dest" in instr:
+                last[instr["dest"]] = site
+            if op != "set" and ("dest" not in instr or op in critical_ops):
+                work.append(site)
+        for var, site in last.items():
+            exposed[var].append(site)
+
+    live = bytearray(len(sites))
+    for site in work:
+        live[site] = 1
+    seen_vars = set()
+    while work:
+        site = work.pop()
+        targets = []
+        for dep in deps[site]:
+            if isinstance(dep, int):
+                targets.append(dep)
+            elif dep not in seen_vars:
+                seen_vars.add(dep)
+                targets.extend(exposed[dep])
+        i, k = sites[site]
+        instr = bb.blocks[i][k]
+        if instr["op"] == "get":
+            targets.extend(sets[instr["dest"]])
+        for t in targets:
+            if not live[t]:
+                live[t] = 1
+                work.append(t)
+
+    site = 0
+    for i, block in enumerate(bb.blocks):
+        kept = []
+        for instr in block:
+            if "op" not in instr:
+                kept.append(instr)
+                continue
+            if live[site]:
+                kept.append(instr)
+            site += 1
+        bb.blocks[i] = kept
+        if block and not kept:
+            # an empty block would be a deleted one, keep it as a label
+            bb.label_of(i)
+    metrics.count("dce.removed", len(sites) - sum(live))
+    return bb
 
 
 if __name__ == "__main__":
-    prog = json.load(sys.stdin)
-
-    for i, func in enumerate(prog["functions"]):
-
-        blocks = BasicBlocks(func)
-        instrs = []
-        for block in blocks.blocks:
-            instrs += local_dce(block)
-
-        func["instrs"] = global_dce(instrs)
-
-    print(json.dumps(prog))
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes, 0 for one per cpu"
+    )
+    cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.from_args(args)
+
+    stages = [("tdce", tdce, None)]
+    cache.run_stream(sys.stdin, sys.stdout, stages, args.jobs, cache.from_args(args))
+    metrics.emit()